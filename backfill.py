@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from chatbot.http import HTTPClient
+from chatbot.metrics import Metrics
+
+from plugins.log import LogParser
+from plugins.search import SearchIndex
+from plugins.activity import ActivityStats
+
+LOGS_PREFIX = "Chat/Logs/"
+
+def page_key(title):
+    """Sort key (day, shard) of a daily log page title, or None for other pages under the prefix."""
+    _, _, rest = title.partition(LOGS_PREFIX)
+    day, _, shard = rest.partition("/")
+    try:
+        return f"{datetime.strptime(day, '%d %B %Y'):%Y-%m-%d}", int(shard or 1)
+    except ValueError:
+        return None
+
+def parse_day(value):
+    return f"{datetime.strptime(value, '%Y-%m-%d'):%Y-%m-%d}"
+
+def message_text(record):
+    return f"/me {record.text}" if record.kind == "me" else record.text
+
+class SearchSink:
+    def __init__(self, path):
+        self.index = SearchIndex(path)
+        self.skip = 0
+
+    def add(self, record):
+        if record.kind in ("message", "me"):
+            if self.skip:
+                self.skip -= 1
+                return
+            self.index.add(record.time, record.name, message_text(record))
+
+    def save(self):
+        return self.index.docs
+
+    def resume(self, docs):
+        # Messages added after the last checkpoint are already in the index, and
+        # the pages after it replay them in the same order.
+        self.skip = max(0, self.index.docs - docs)
+
+    def close(self):
+        self.index.close()
+
+class ActivitySink:
+    def __init__(self, path):
+        self.path = path
+        self.stats = ActivityStats.load(path)
+        self.online = {}
+
+    def add(self, record):
+        if record.kind in ("message", "me"):
+            self.stats.record_message(record.name, message_text(record), record.time)
+        elif record.kind == "join":
+            self.stats.record_join(record.name, record.time)
+        elif record.kind in ("leave", "kick", "ban"):
+            self.stats.record_leave(record.name, record.time)
+            self.online.pop(record.name.lower(), None)
+            return
+        if record.name.lower() in self.online or record.kind == "join":
+            self.online[record.name.lower()] = (record.name, record.time)
+
+    def save(self):
+        self.stats.save(self.path)
+
+    def finish(self):
+        # Sessions the logs never saw end would otherwise be counted as still online.
+        for name, last_seen in self.online.values():
+            self.stats.record_leave(name, last_seen)
+
+    def close(self):
+        pass
+
+class SeenSink:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as seen_file:
+                self.seen = json.load(seen_file)
+        except FileNotFoundError:
+            self.seen = {}
+
+    def add(self, record):
+        key = record.name.lower()
+        if record.time > self.seen.get(key, 0):
+            self.seen[key] = record.time
+
+    def save(self):
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as seen_file:
+            json.dump(self.seen, seen_file)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def close(self):
+        self.save()
+
+class Backfill:
+    """Replays the chat log pages of a wiki into sinks, oldest first, a batch of pages per request.
+
+    Days from until (YYYY-MM-DD) on are left out, so days the bot already
+    recorded live are not counted twice.
+    """
+
+    def __init__(self, site, sinks, checkpoint, workers=4, batch=10, checkpoint_every=20, retries=3, until=None):
+        self.site = site
+        self.sinks = sinks
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.batch = batch
+        self.checkpoint_every = checkpoint_every
+        self.retries = retries
+        self.until = until
+        self.http = HTTPClient(Metrics(), max_per_host=workers)
+        self.parser = LogParser()
+        self.logger = logging.getLogger("backfill")
+        self.done = None
+        self.pages = 0
+        self.records = 0
+
+    def api(self, **params):
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.http.post(self.site + "api.php", data={**params, "format": "json"})
+                response.raise_for_status()
+                return response.json()
+            except (requests.RequestException, ValueError) as e:
+                if attempt == self.retries:
+                    raise
+                self.logger.warning(f"API request failed, retrying: {e}")
+                time.sleep(2 ** attempt)
+
+    def titles(self):
+        params = {"action": "query", "list": "allpages", "apnamespace": 4, "apprefix": LOGS_PREFIX, "aplimit": "max"}
+        while True:
+            response = self.api(**params)
+            for page in response["query"]["allpages"]:
+                yield page["title"]
+            cont = response.get("continue") or response.get("query-continue", {}).get("allpages")
+            if not cont:
+                return
+            params.update(cont)
+
+    def fetch(self, titles):
+        response = self.api(action="query", prop="revisions", rvprop="content", titles="|".join(titles))
+        contents = {}
+        for page in response["query"]["pages"].values():
+            if "revisions" in page:
+                contents[page["title"]] = page["revisions"][0]["*"]
+        return contents
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint, encoding="utf-8") as checkpoint_file:
+                state = json.load(checkpoint_file)
+        except FileNotFoundError:
+            # Record where the sinks start, so a run stopped before its first
+            # checkpoint resumes from here too.
+            self.save_checkpoint()
+            return
+        self.done = tuple(state["done"]) if state["done"] else None
+        self.pages = state["pages"]
+        self.records = state["records"]
+        sinks = state.get("sinks", {})
+        for sink in self.sinks:
+            if hasattr(sink, "resume") and type(sink).__name__ in sinks:
+                sink.resume(sinks[type(sink).__name__])
+        if self.done is not None:
+            self.logger.info(f"Resuming after {self.done[0]} part {self.done[1]}.")
+
+    def save_checkpoint(self):
+        sinks = {}
+        for sink in self.sinks:
+            state = sink.save()
+            if state is not None:
+                sinks[type(sink).__name__] = state
+        with open(f"{self.checkpoint}.tmp", "w", encoding="utf-8") as checkpoint_file:
+            json.dump({"done": self.done, "pages": self.pages, "records": self.records, "sinks": sinks}, checkpoint_file)
+        os.replace(f"{self.checkpoint}.tmp", self.checkpoint)
+
+    def run(self):
+        self.load_checkpoint()
+        pages = []
+        for title in self.titles():
+            key = page_key(title)
+            if key is None or (self.until is not None and key[0] >= self.until):
+                continue
+            if self.done is None or key > self.done:
+                pages.append((key, title))
+        pages.sort()
+        self.logger.info(f"{len(pages)} log pages to import.")
+        batches = iter([pages[i:i + self.batch] for i in range(0, len(pages), self.batch)])
+        window = deque()
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="backfill") as executor:
+            def submit():
+                batch = next(batches, None)
+                if batch is not None:
+                    window.append((batch, executor.submit(self.fetch, [title for _, title in batch])))
+
+            for _ in range(self.workers * 2):
+                submit()
+            importing = None
+            try:
+                while window:
+                    batch, future = window.popleft()
+                    contents = future.result()
+                    submit()
+                    for key, title in batch:
+                        importing = title
+                        self.import_page(title, contents.get(title, ""))
+                        importing = None
+                        self.done = key
+                        self.pages += 1
+                        if self.pages % self.checkpoint_every == 0:
+                            self.save_checkpoint()
+                            self.logger.info(f"Imported {self.pages} pages, {self.records} records.")
+                for sink in self.sinks:
+                    if hasattr(sink, "finish"):
+                        sink.finish()
+            finally:
+                for _, future in window:
+                    future.cancel()
+                # A page stopped halfway is imported again on resume, so only checkpoint between pages.
+                if importing is None:
+                    self.save_checkpoint()
+                for sink in self.sinks:
+                    sink.close()
+        self.logger.info(f"Imported {self.pages} pages, {self.records} records; skipped {self.parser.skipped} unrecognized lines.")
+
+    def import_page(self, title, content):
+        for record in self.parser.parse(content):
+            self.records += 1
+            for sink in self.sinks:
+                sink.add(record)
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the wiki's chat log pages into the bot's search index, activity stats and seen times. Stop the bot first; the files are not safe to share.")
+    parser.add_argument("--site", help="wiki URL ending in /, defaults to the wiki in config.json")
+    parser.add_argument("--search", metavar="DIR", help="search index directory (SearchPlugin uses search)")
+    parser.add_argument("--activity", metavar="FILE", help="activity stats file (ActivityPlugin uses activity.json)")
+    parser.add_argument("--seen", metavar="FILE", help="last seen times file (SeenPlugin uses seen.json)")
+    parser.add_argument("--checkpoint", metavar="FILE", default="backfill.json", help="progress file to resume from")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and import everything again")
+    parser.add_argument("--workers", type=int, default=4, help="parallel page requests")
+    parser.add_argument("--batch", type=int, default=10, help="pages per request")
+    parser.add_argument("--checkpoint-every", type=int, default=20, metavar="PAGES")
+    parser.add_argument("--until", type=parse_day, metavar="YYYY-MM-DD", help="only import the days before this one; pass the day the bot started running, as days it recorded itself would be counted twice")
+    args = parser.parse_args()
+    logging.basicConfig(format="[%(levelname)s] %(name)s: %(message)s", level=logging.INFO)
+
+    site = args.site
+    if site is None:
+        try:
+            with open("config.json") as file:
+                site = f'https://{json.load(file)["wiki"]}.fandom.com/'
+        except FileNotFoundError:
+            parser.error("--site is required without a config.json")
+    sinks = []
+    if args.search:
+        sinks.append(SearchSink(args.search))
+    if args.activity:
+        sinks.append(ActivitySink(args.activity))
+    if args.seen:
+        sinks.append(SeenSink(args.seen))
+    if not sinks:
+        parser.error("nothing to import into, pass --search, --activity or --seen")
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    backfill = Backfill(site, sinks, args.checkpoint, args.workers, args.batch, args.checkpoint_every, until=args.until)
+    try:
+        backfill.run()
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logging.critical(f"Import stopped, rerun to resume: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
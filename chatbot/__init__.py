@@ -1 +1 @@
-from .chatbot import ChatBot, ClientError
+from .chatbot import ChatBot, ClientError, AuthError
@@ -1,10 +1,27 @@
+import os
+import sys
+import gzip
 import json
 import logging
+import importlib
+from random import uniform
+from threading import Event, Lock, Thread
+from time import monotonic, time
 from urllib.parse import urlencode, urlparse, urlunparse
 
 from .page import Page
+from .edits import EditQueue
+from .http import HTTPClient
+from .metrics import Metrics
+from .scheduler import Scheduler
+from .dispatch import Dispatcher
+from .history import History
+from .memory import MemoryProfiler
+from .latency import LatencyTracker
+from .isolation import IsolatedPlugin, WorkerError
+from .events import MessageEvent, JoinEvent, PartEvent, KickEvent, BanEvent, takes_event
 from .users import User, Rank, RankError
-from .plugins import ArgumentError
+from .plugins import ArgumentError, Priority
 
 import requests
 import socketio
@@ -12,14 +29,81 @@ import socketio
 class ClientError(Exception):
     pass
 
+class AuthError(ClientError):
+    pass
+
+class Reconnector:
+    def __init__(self, client, min_delay=1, max_delay=300):
+        self.client = client
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.logger = logging.getLogger(f"{__package__}.Reconnector")
+        self.stopped = Event()
+        self.lock = Lock()
+        self.thread = None
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.min_delay * 2 ** attempt)
+        return uniform(delay / 2, delay)
+
+    def schedule(self):
+        with self.lock:
+            if self.stopped.is_set() or (self.thread is not None and self.thread.is_alive()):
+                return
+            self.thread = Thread(target=self.run, name="reconnect")
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        started = monotonic()
+        attempt = 0
+        while not self.stopped.wait(self.delay(attempt)):
+            attempt += 1
+            self.logger.info(f"Reconnecting (attempt {attempt})...")
+            try:
+                try:
+                    self.client.connect()
+                except AuthError:
+                    self.logger.info("Session expired, logging in again.")
+                    self.client.metrics.increment("reconnect.logins")
+                    self.client.login()
+                    self.client.connect()
+            except (ClientError, requests.RequestException, socketio.exceptions.ConnectionError, KeyError, ValueError) as e:
+                self.logger.info(f"Reconnect failed: {e}")
+                self.client.metrics.increment("reconnect.failures")
+                continue
+            self.client.metrics.increment("reconnect.count")
+            self.client.metrics.observe("reconnect.time", monotonic() - started)
+            return
+
+PLAIN_TYPES = (bool, int, float, str, bytes, list, tuple, dict, set, frozenset, type(None))
+
+def plugin_class(plugin):
+    if isinstance(plugin, IsolatedPlugin):
+        return plugin.cls
+    return type(plugin)
+
 class ChatBot:
-    def __init__(self, username, password, site, socketio_logger=False):
+    def __init__(self, username, password, site, socketio_logger=False, reconnect=True, latency_budget=2.0, http2=False, history_size=5000, history_bytes=1 << 20, edits_per_minute=10):
         self.username = username
         self.password = password
         self.site = site
         self.user = User(self.username, None, False)
         self.session = requests.Session()
-        self.sio = socketio.Client()
+        self.sio = socketio.Client(reconnection=False)
+        self.metrics = Metrics()
+        self.scheduler = Scheduler(self.metrics)
+        self.dispatcher = Dispatcher(self.metrics, latency_budget)
+        self.http = HTTPClient(self.metrics, http2=http2)
+        self.history = History(history_size, history_bytes)
+        self.edits = EditQueue(self, edits_per_minute)
+        self.memory = MemoryProfiler(self)
+        self.latency = LatencyTracker(self.metrics)
+        self.reconnector = Reconnector(self)
+        if not reconnect:
+            self.reconnector.stop()
         self.logger = logging.getLogger(__name__)
         if not socketio_logger:
             for handler in logging.root.handlers:
@@ -33,9 +117,19 @@ class ChatBot:
             self.sio.on(event, handler)
         self.users = {}
         self.plugins = []
+        self.filters = {}
+        self.server_id = None
+        self.ready = Event()
+        self.stopped = Event()
+        self.paused = None
 
-    def add_plugin(self, plugin):
+    def add_plugin(self, plugin, isolate=False, timeout=5):
         logger = logging.getLogger(f"{__package__}.{type(plugin).__name__}")
+        if isolate:
+            try:
+                plugin = IsolatedPlugin(plugin, timeout)
+            except WorkerError as e:
+                raise ClientError(str(e)) from e
         try:
             plugin.on_load(self, logger)
         except:
@@ -47,9 +141,224 @@ class ChatBot:
         for plugin in plugins:
             self.add_plugin(plugin)
 
+    def find_plugin(self, name):
+        name = name.lower()
+        for i, (plugin, _) in enumerate(self.plugins):
+            cls = plugin_class(plugin)
+            if name in (cls.__name__.lower(), cls.__name__.lower()[:-len("plugin")], cls.__module__.lower(), cls.__module__.lower().rsplit(".", 1)[-1]):
+                return i
+        raise ClientError(f"No plugin named {name}.")
+
+    def reload_plugin(self, name):
+        index = self.find_plugin(name)
+        old, logger = self.plugins[index]
+        if isinstance(old, IsolatedPlugin):
+            old.restart("reloading", graceful=True)
+            self.metrics.increment("plugins.reloads")
+            logger.info("Reloaded.")
+            return
+        module = sys.modules[type(old).__module__]
+        saved = dict(module.__dict__)
+
+        def rollback():
+            module.__dict__.clear()
+            module.__dict__.update(saved)
+
+        try:
+            importlib.reload(module)
+            cls = getattr(module, type(old).__name__)
+            args, kwargs = getattr(old, "init_args", ((), {}))
+            plugin = cls(*args, **kwargs)
+            if hasattr(old, "export_state") and hasattr(plugin, "import_state"):
+                plugin.import_state(old.export_state())
+            else:
+                # Without export_state, carry plain values over; locks, jobs and other
+                # resources belong to the old instance and on_load builds new ones.
+                plugin.__dict__.update({key: value for key, value in old.__dict__.items() if isinstance(value, PLAIN_TYPES)})
+        except Exception as e:
+            rollback()
+            raise ClientError(f"Failed to reload {type(old).__name__}: {e}") from e
+
+        old.on_unload()
+        try:
+            plugin.on_load(self, logger)
+            self.check_plugin(plugin)
+        except Exception as e:
+            try:
+                plugin.on_unload()
+            except Exception:
+                logger.exception("Failed to unload the new version.")
+            rollback()
+            old.on_load(self, logger)
+            if self.sio.connected:
+                old.on_connect()
+            raise ClientError(f"Failed to load the new {type(old).__name__}: {e}") from e
+        self.plugins[index] = (plugin, logger)
+        self.filters = {key: value for key, value in self.filters.items() if key[0] is not old}
+        if self.sio.connected:
+            plugin.on_connect()
+        self.metrics.increment("plugins.reloads")
+        logger.info("Reloaded.")
+
+    @staticmethod
+    def check_plugin(plugin):
+        """Sanity check a reloaded plugin before it replaces the old one."""
+        if hasattr(plugin, "export_state"):
+            plugin.export_state()
+        for name, command in plugin.commands.items():
+            if command.handler is None or command.name != name:
+                raise ClientError(f"Command {name} is not bound.")
+
+    def watch_plugins(self, interval=2):
+        def mtime(plugin):
+            try:
+                return os.stat(sys.modules[plugin_class(plugin).__module__].__file__).st_mtime
+            except (OSError, AttributeError):
+                return None
+
+        mtimes = {plugin_class(plugin).__module__: mtime(plugin) for plugin, _ in self.plugins}
+
+        def check():
+            for plugin, logger in self.plugins:
+                module = plugin_class(plugin).__module__
+                current = mtime(plugin)
+                if current is not None and current != mtimes.get(module):
+                    mtimes[module] = current
+                    self.dispatcher.submit(Priority.MODERATION, self.reload_watched, module)
+
+        return self.scheduler.call_every(interval, check, persistent=True)
+
+    def reload_watched(self, module):
+        try:
+            self.reload_plugin(module)
+        except ClientError as e:
+            self.logger.error(str(e))
+
     def start(self):
         if not self.plugins:
             self.logger.warning("No plugins loaded.")
+        self.scheduler.start()
+        self.dispatcher.start()
+        self.edits.start()
+        if self.session.cookies:
+            try:
+                self.connect()
+                return
+            except AuthError:
+                self.logger.info("Saved session expired, logging in again.")
+        self.login()
+        self.connect()
+
+    def snapshot(self):
+        plugins = {}
+        for plugin, logger in self.plugins:
+            if hasattr(plugin, "export_state"):
+                cls = plugin_class(plugin)
+                try:
+                    plugins[f"{cls.__module__}.{cls.__name__}"] = plugin.export_state()
+                except Exception:
+                    logger.exception("Failed to export state.")
+        return {
+            "version": 1,
+            "time": time(),
+            "server_id": self.server_id,
+            "cookies": [[cookie.name, cookie.value, cookie.domain, cookie.path] for cookie in self.session.cookies],
+            "users": [[user.name, user.rank, user.connected, user.ignored] for user in self.users.values()],
+            "plugins": plugins,
+        }
+
+    def save_snapshot(self, path, timeout=10, pause=False):
+        """Write a snapshot to path; with pause, also hand the plugins' files over to whoever loads it.
+
+        Pausing stops delivering events to plugins from the moment the snapshot
+        is taken, stops the scheduler and unloads the plugins so that they flush
+        and close their files, all before the snapshot file appears. The
+        connection stays up until detach(); resume() undoes the pause if the
+        new process never takes over.
+        """
+        done = Event()
+        result = {}
+
+        def take():
+            result["snapshot"] = self.snapshot()
+            if pause:
+                self.paused = result["snapshot"]
+            done.set()
+
+        if self.dispatcher.thread is not None and self.dispatcher.thread.is_alive():
+            self.dispatcher.submit(Priority.MODERATION, take)
+            if not done.wait(timeout):
+                raise ClientError("Timed out waiting for plugins to snapshot their state.")
+        else:
+            take()
+        if pause:
+            # Unload and drain while the scheduler still runs, so the callbacks of saved edits
+            # (like LogPlugin archiving an uploaded segment) run before the snapshot is written.
+            for plugin, logger in self.plugins:
+                try:
+                    plugin.on_unload()
+                except Exception:
+                    logger.exception("Failed to unload.")
+            if not self.edits.drain(timeout):
+                self.logger.warning(f"{len(self.edits)} wiki edits were still queued after {timeout} seconds.")
+            self.scheduler.stop()
+            self.logger.info("Paused plugins for the handoff.")
+        # The snapshot holds the session cookies.
+        descriptor = os.open(f"{path}.tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        os.fchmod(descriptor, 0o600)
+        with open(descriptor, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as snapshot_file:
+            json.dump(result["snapshot"], snapshot_file, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+        self.logger.info(f"Saved snapshot to {path}.")
+
+    def resume(self):
+        snapshot, self.paused = self.paused, None
+        if snapshot is None:
+            return
+        for plugin, logger in self.plugins:
+            cls = plugin_class(plugin)
+            state = snapshot["plugins"].get(f"{cls.__module__}.{cls.__name__}")
+            try:
+                plugin.on_load(self, logger)
+                if state is not None and hasattr(plugin, "import_state"):
+                    plugin.import_state(state)
+                if self.sio.connected:
+                    plugin.on_connect()
+            except Exception:
+                logger.exception("Failed to resume.")
+        self.scheduler.start()
+        self.logger.info("Resumed plugins after an aborted handoff.")
+
+    def load_snapshot(self, path, max_age=600):
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+            return False
+        if time() - snapshot["time"] <= max_age:
+            self.server_id = snapshot["server_id"]
+            for name, value, domain, path in snapshot["cookies"]:
+                self.session.cookies.set(name, value, domain=domain, path=path)
+            for name, rank, connected, ignored in snapshot["users"]:
+                user = User(name, None if rank is None else Rank(rank), connected)
+                user.ignored = ignored
+                self.users[name.lower()] = user
+            self.user = self.users.get(self.username.lower(), self.user)
+        for plugin, logger in self.plugins:
+            cls = plugin_class(plugin)
+            state = snapshot["plugins"].get(f"{cls.__module__}.{cls.__name__}")
+            if state is not None and hasattr(plugin, "import_state"):
+                try:
+                    plugin.import_state(state)
+                except Exception:
+                    logger.exception("Failed to import state.")
+        self.logger.info(f"Restored snapshot from {path}.")
+        return True
+
+    def login(self):
         self.logger.info(f"Logging in as {self.user}...")
         response = self.session.post(self.site + "api.php", params={
             "action": "login",
@@ -68,27 +377,36 @@ class ChatBot:
         if response["login"]["result"] != "Success":
             raise ClientError(f'Log in failed: {response["login"]["result"]}')
 
+    def connect(self):
         wikia_data = self.session.get(self.site + "wikia.php", params={
             "controller": "Chat",
             "format": "json",
         }).json()
-        api_data = self.session.get(self.site + "api.php", params={
-            "action": "query",
-            "meta": "siteinfo",
-            "siprop": "wikidesc",
-            "format": "json",
-        }).json()
-        url = list(urlparse(f'https://{wikia_data["chatServerHost"]}/socket.io/'))
+        if not wikia_data.get("chatkey"):
+            raise AuthError("Not logged in.")
+        if self.server_id is None:
+            api_data = self.session.get(self.site + "api.php", params={
+                "action": "query",
+                "meta": "siteinfo",
+                "siprop": "wikidesc",
+                "format": "json",
+            }).json()
+            self.server_id = api_data["query"]["wikidesc"]["id"]
+        url = list(urlparse(f'{urlparse(self.site).scheme}://{wikia_data["chatServerHost"]}/socket.io/'))
         url[4] = urlencode({
             "name": self.user.name,
             "key": wikia_data["chatkey"],
             "roomId": wikia_data["roomId"],
-            "serverId": api_data["query"]["wikidesc"]["id"],
+            "serverId": self.server_id,
         })
-        self.sio.connect(urlunparse(url))
+        try:
+            self.sio.connect(urlunparse(url), transports=["websocket"])
+        except socketio.exceptions.ConnectionError:
+            self.logger.info("WebSocket connection failed, falling back to polling.")
+            self.sio.connect(urlunparse(url))
 
-    def open_page(self, title):
-        return Page(self, title)
+    def open_page(self, title, content=True):
+        return Page(self, title, content)
 
     def send(self, attrs):
         self.sio.send(json.dumps({
@@ -102,6 +420,7 @@ class ChatBot:
             "name": self.user.name,
             "text": text,
         })
+        self.latency.sent(text)
 
     def kick(self, username):
         self.send({
@@ -119,7 +438,14 @@ class ChatBot:
             "reason": reason,
         })
 
+    def stop_workers(self):
+        for plugin, _ in self.plugins:
+            if isinstance(plugin, IsolatedPlugin):
+                plugin.on_unload()
+
     def logout(self):
+        self.reconnector.stop()
+        self.scheduler.stop()
         self.send({
             "msgType": "command",
             "command": "logout",
@@ -127,6 +453,17 @@ class ChatBot:
         self.sio.disconnect()
         self.sio.wait()
         self.on_disconnect()
+        self.stop_workers()
+        self.stopped.set()
+
+    def detach(self):
+        """Drop the connection without logging out, leaving the session to a new process."""
+        self.reconnector.stop()
+        self.scheduler.stop()
+        self.sio.disconnect()
+        self.sio.wait()
+        self.stop_workers()
+        self.stopped.set()
 
     def on_connect(self):
         self.logger.info(f"Logged in as {self.user}.")
@@ -134,6 +471,8 @@ class ChatBot:
             "msgType": "command",
             "command": "initquery",
         })
+        if self.paused is not None:
+            return
         for plugin, logger in self.plugins:
             try:
                 plugin.on_connect()
@@ -153,43 +492,92 @@ class ChatBot:
 
     def on_disconnect(self):
         self.logger.info("Logged out.")
-        for plugin, logger in self.plugins:
-            try:
-                plugin.on_disconnect()
-            except:
-                logger.exception("Failed on disconnect.")
+        if self.paused is None:
+            for plugin, logger in self.plugins:
+                try:
+                    plugin.on_disconnect()
+                except:
+                    logger.exception("Failed on disconnect.")
+        self.ready.clear()
+        self.scheduler.cancel_all()
+        self.metrics.increment("disconnects")
+        self.reconnector.schedule()
 
     def on_event(self, data):
-        handler = {
-            "meta": lambda d: None,
-            "initial": self.on_initial,
-            "updateUser": self.on_update_user,
-            "join": self.on_join,
-            "logout": self.on_logout,
-            "part": self.on_logout,
-            "kick": self.on_kick,
-            "ban": self.on_ban,
-            "chat:add": self.on_message,
-        }.get(data["event"])
+        handler, event_type = {
+            "meta": (lambda d: None, None),
+            "initial": (self.on_initial, None),
+            "updateUser": (self.on_update_user, None),
+            "join": (self.on_join, JoinEvent),
+            "logout": (self.on_logout, PartEvent),
+            "part": (self.on_logout, PartEvent),
+            "kick": (self.on_kick, KickEvent),
+            "ban": (self.on_ban, BanEvent),
+            "chat:add": (self.on_message, MessageEvent),
+        }.get(data["event"], (None, None))
         if handler is None:
-            self.logger.warning(f'Unhandled {data["event"]} event: {data}')
+            self.logger.warning("Unhandled %s event: %s", data["event"], data)
             return
         if not isinstance(data["data"], dict):
             data["data"] = json.loads(data["data"])
-        handler(data["data"])
+        if event_type is None:
+            handler(data["data"])
+        else:
+            handler(data["data"], event_type(self, data["data"]))
+
+    def event_filter(self, plugin, hook):
+        """Return the predicates checked as the event arrives and, for ones reading the plugin's state, on the dispatcher."""
+        if isinstance(plugin, IsolatedPlugin):
+            # The worker checks users functions itself.
+            return plugin.filters.get(hook), None
+        key = (plugin, hook)
+        if key not in self.filters:
+            declared = getattr(getattr(type(plugin), hook, None), "filter", None)
+            self.filters[key] = (None, None) if declared is None else (declared.compile(), declared.check_users(plugin))
+        return self.filters[key]
+
+    def filtered(self, plugin, accepted):
+        name = plugin_class(plugin).__name__
+        if accepted:
+            self.metrics.increment(f"filters.{name}.delivered")
+            return
+        self.metrics.increment(f"filters.{name}.skipped")
+
+    def notify(self, hook, data, event=None):
+        if self.paused is not None:
+            return
+        for plugin, logger in self.plugins:
+            if isinstance(plugin, IsolatedPlugin):
+                plugin.track(hook, data)
+            accepts, late = (None, None) if event is None else self.event_filter(plugin, hook)
+            if accepts is not None and not accepts(event):
+                self.filtered(plugin, False)
+                continue
+            if accepts is not None and late is None:
+                self.filtered(plugin, True)
+            args = (data, event) if event is not None and takes_event(getattr(type(plugin), hook)) else (data,)
+            self.dispatcher.submit(plugin.PRIORITY, self.call_hook, plugin, logger, hook, args, event, late)
+
+    def call_hook(self, plugin, logger, hook, args, event=None, late=None):
+        if self.paused is not None:
+            return
+        if late is not None:
+            accepted = late(event)
+            self.filtered(plugin, accepted)
+            if not accepted:
+                return
+        try:
+            getattr(plugin, hook)(*args)
+        except:
+            logger.exception(f'Failed on {hook[len("on_"):].replace("_", " ")}.')
 
-    def on_join(self, data):
-        username = data["attrs"]["name"]
+    def on_join(self, data, event):
         rank = Rank.from_attrs(data["attrs"])
-        user = User(username, rank)
-        self.users[user.name.lower()] = user
+        user = User(event.name, rank)
+        self.users[event.key] = user
         if user.name == self.username:
             self.user = user
-        for plugin, logger in self.plugins:
-            try:
-                plugin.on_join(data)
-            except:
-                logger.exception("Failed on join.")
+        self.notify("on_join", data, event)
 
     def update_user(self, attrs):
         username = attrs["name"]
@@ -197,66 +585,62 @@ class ChatBot:
         self.users[username.lower()] = User(username, rank)
 
     def on_initial(self, data):
+        for user in self.users.values():
+            user.connected = False
         for user in data["collections"]["users"]["models"]:
             self.update_user(user["attrs"])
-        for plugin, logger in self.plugins:
-            try:
-                plugin.on_initial(data)
-            except:
-                logger.exception("Failed on initial.")
+        self.ready.set()
+        self.notify("on_initial", data)
 
     def on_update_user(self, data):
         self.update_user(data["attrs"])
 
-    def on_logout(self, data):
-        username = data["attrs"]["name"]
-        user = self.users[username.lower()]
-        user.connected = False
-        for plugin, logger in self.plugins:
-            try:
-                plugin.on_logout(data)
-            except:
-                logger.exception("Failed on logout.")
+    def on_logout(self, data, event):
+        event.user.connected = False
+        self.notify("on_logout", data, event)
 
-    def on_kick(self, data):
-        for plugin, logger in self.plugins:
-            try:
-                plugin.on_kick(data)
-            except:
-                logger.exception("Failed on kick.")
+    def on_kick(self, data, event):
+        self.notify("on_kick", data, event)
+
+    def on_ban(self, data, event):
+        self.notify("on_ban", data, event)
 
-    def on_ban(self, data):
+    def check_command(self, user, command):
         for plugin, logger in self.plugins:
             try:
-                plugin.on_ban(data)
+                if not plugin.check_command(user, command):
+                    return False
             except:
-                logger.exception("Failed on ban.")
+                logger.exception("Failed on command check.")
+        return True
+
+    def run_command(self, plugin, logger, command, user, data, event):
+        if self.paused is not None or not self.check_command(user, command):
+            return
+        try:
+            command(plugin, self.users, data, event)
+            self.metrics.observe("latency.processing", time() - event.received)
+        except RankError:
+            self.send_message(f"{user}, you don't have permission for {command}.")
+        except ArgumentError as e:
+            self.send_message(f"{user}, {e}")
+        except:
+            logger.exception(f"Command {command} failed.")
 
-    def on_message(self, data):
+    def on_message(self, data, event):
         if data["id"] is None:
             return
-        for plugin, logger in self.plugins:
-            try:
-                plugin.on_message(data)
-            except:
-                logger.exception("Failed on message.")
-        username = data["attrs"]["name"]
-        user = self.users[username.lower()]
+        self.latency.received(event)
+        self.history.add(event.time, event.name, event.body, event.me)
+        self.notify("on_message", data, event)
+        user = event.user
         if user.ignored:
             return
-        message = data["attrs"]["text"]
-        if message.lstrip().startswith("!"):
-            command_name = message.split()[0][1:]
+        if event.command_name is not None:
             for plugin, logger in self.plugins:
-                command = plugin.commands.get(command_name)
+                command = plugin.commands.get(event.command_name)
                 if command is None:
                     continue
-                try:
-                    command(plugin, self.users, data)
-                except RankError:
-                    self.send_message(f"{user}, you don't have permission for {command}.")
-                except ArgumentError as e:
-                    self.send_message(f"{user}, {e}")
-                except:
-                    logger.exception(f"Command {command} failed.")
+                priority = Priority.MODERATION if command.min_rank >= Rank.MODERATOR else Priority.COMMAND
+                self.dispatcher.submit(priority, self.run_command, plugin, logger, command, user, data, event)
                 break
@@ -0,0 +1,50 @@
+import heapq
+import logging
+from itertools import count
+from threading import Condition, Thread
+from time import monotonic
+
+from .plugins import Priority
+
+class Dispatcher:
+    def __init__(self, metrics, latency_budget=2.0, shed_priority=Priority.PREVIEW):
+        self.metrics = metrics
+        self.latency_budget = latency_budget
+        self.shed_priority = shed_priority
+        self.logger = logging.getLogger(f"{__package__}.Dispatcher")
+        self.heap = []
+        self.counter = count()
+        self.condition = Condition()
+        self.thread = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = Thread(target=self.run, name="dispatcher", daemon=True)
+        self.thread.start()
+
+    def submit(self, priority, callback, *args):
+        with self.condition:
+            heapq.heappush(self.heap, (priority, next(self.counter), monotonic(), callback, args))
+            self.metrics.set("dispatch.backlog", len(self.heap))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.heap:
+                    self.condition.wait()
+                priority, _, submitted, callback, args = heapq.heappop(self.heap)
+                self.metrics.set("dispatch.backlog", len(self.heap))
+            name = priority.name.lower()
+            waited = monotonic() - submitted
+            self.metrics.observe(f"dispatch.wait.{name}", waited)
+            if waited > self.latency_budget:
+                if priority >= self.shed_priority:
+                    self.metrics.increment(f"dispatch.shed.{name}")
+                    continue
+                self.metrics.increment(f"dispatch.late.{name}")
+            try:
+                callback(*args)
+            except:
+                self.logger.exception(f"Dispatching {callback} failed.")
@@ -0,0 +1,213 @@
+import logging
+from collections import OrderedDict, deque
+from threading import Condition, Event, Thread
+from time import monotonic
+
+import requests
+
+from .page import Page, EditError
+
+CONFLICTS = {"editconflict", "articleexists", "pagedeleted"}
+
+class EditRequest:
+    """A handle to a queued edit; resolved once the edit it was coalesced into is saved."""
+
+    def __init__(self, transform, summary, callback, text=None):
+        self.transform = transform
+        self.text = text
+        self.summary = summary
+        self.callback = callback
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+    def resolve(self, result, error):
+        self.result = result
+        self.error = error
+        self.done.set()
+        if self.callback is not None:
+            self.callback(result, error)
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise TimeoutError("The edit is still pending.")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+class PendingEdit:
+    __slots__ = ("title", "append", "requests", "attempts", "not_before")
+
+    def __init__(self, title, append=False):
+        self.title = title
+        self.append = append
+        self.requests = []
+        self.attempts = 0
+        self.not_before = 0.0
+
+    @property
+    def summary(self):
+        summaries = []
+        for request in self.requests:
+            if request.summary and request.summary not in summaries:
+                summaries.append(request.summary)
+        return "; ".join(summaries)
+
+    @property
+    def key(self):
+        return self.title, self.append
+
+    @property
+    def text(self):
+        return "".join(request.text for request in self.requests)
+
+    def apply(self, content):
+        for request in self.requests:
+            content = request.transform(content)
+        return content
+
+class EditQueue:
+    """Serializes wiki edits: coalesces them per title, paces them and retries conflicts.
+
+    Appends are sent with appendtext and never fetch the page; they are only
+    coalesced with other appends, never with rewrites of the same title.
+    An edits_per_minute of 0 or less turns pacing off.
+    """
+
+    def __init__(self, client, edits_per_minute=10, maxlag=5, max_retries=3, retry_delay=30):
+        self.client = client
+        self.edits_per_minute = edits_per_minute
+        self.maxlag = maxlag
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.logger = logging.getLogger(f"{__package__}.EditQueue")
+        self.pending = OrderedDict()
+        self.recent = deque(maxlen=edits_per_minute) if edits_per_minute > 0 else None
+        self.condition = Condition()
+        self.saving = None
+        self.thread = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = Thread(target=self.run, name="edits", daemon=True)
+        self.thread.start()
+
+    def submit(self, title, transform, summary="", callback=None):
+        """Queue transform(content) -> content for title; returns an EditRequest."""
+        return self.queue(PendingEdit(title), EditRequest(transform, summary, callback))
+
+    def append(self, title, text, summary="", callback=None):
+        """Queue text to be appended to title without fetching it; returns an EditRequest."""
+        return self.queue(PendingEdit(title, append=True), EditRequest(None, summary, callback, text))
+
+    def queue(self, new, request):
+        with self.condition:
+            pending = self.pending.get(new.key)
+            if pending is None:
+                pending = self.pending[new.key] = new
+            else:
+                self.client.metrics.increment("edits.coalesced")
+            pending.requests.append(request)
+            self.client.metrics.set("edits.queued", len(self.pending))
+            self.condition.notify_all()
+        return request
+
+    def next_edit(self):
+        with self.condition:
+            while True:
+                now = monotonic()
+                wait = None
+                if self.recent is not None and len(self.recent) == self.recent.maxlen:
+                    wait = self.recent[0] + 60 - now
+                if wait is None or wait <= 0:
+                    ready = [pending for pending in self.pending.values() if pending.not_before <= now]
+                    if ready:
+                        pending = ready[0]
+                        del self.pending[pending.key]
+                        self.saving = pending
+                        self.client.metrics.set("edits.queued", len(self.pending))
+                        if self.recent is not None:
+                            self.recent.append(now)
+                        return pending
+                    if self.pending:
+                        wait = min(pending.not_before for pending in self.pending.values()) - now
+                self.condition.wait(wait)
+
+    def requeue(self, pending, delay):
+        pending.attempts += 1
+        pending.not_before = monotonic() + delay
+        with self.condition:
+            later = self.pending.pop(pending.key, None)
+            if later is not None:
+                pending.requests.extend(later.requests)
+            self.pending[pending.key] = pending
+            self.pending.move_to_end(pending.key, last=False)
+            self.saving = None
+            self.client.metrics.set("edits.queued", len(self.pending))
+            self.condition.notify_all()
+
+    def save(self, pending):
+        if pending.append:
+            return Page(self.client, pending.title, content=False).append(pending.text, pending.summary, self.maxlag)
+        page = Page(self.client, pending.title)
+        content = pending.apply(page.content)
+        if content == page.content:
+            return {"result": "Success", "title": pending.title, "nochange": ""}
+        page.content = content
+        return page.save(pending.summary, self.maxlag)
+
+    def run(self):
+        while True:
+            pending = self.next_edit()
+            try:
+                with self.client.metrics.timer("edits.time"):
+                    result = self.save(pending)
+            except EditError as e:
+                if e.code == "maxlag":
+                    self.client.metrics.increment("edits.maxlag")
+                    self.requeue(pending, max(float(e.lag or 0), self.maxlag))
+                    continue
+                if e.code in CONFLICTS and pending.attempts < self.max_retries:
+                    self.client.metrics.increment("edits.conflicts")
+                    self.requeue(pending, 0)
+                    continue
+                if e.code == "ratelimited" and pending.attempts < self.max_retries:
+                    self.client.metrics.increment("edits.ratelimited")
+                    self.requeue(pending, 60)
+                    continue
+                self.finish(pending, None, e)
+            except (requests.RequestException, KeyError, ValueError) as e:
+                if pending.attempts < self.max_retries:
+                    self.logger.warning(f"Saving {pending.title} failed, retrying: {e}")
+                    self.requeue(pending, self.retry_delay * 2 ** pending.attempts)
+                    continue
+                self.finish(pending, None, e)
+            except Exception as e:
+                self.logger.exception(f"Saving {pending.title} failed.")
+                self.finish(pending, None, e)
+            else:
+                self.finish(pending, result, None)
+
+    def drain(self, timeout=None):
+        """Wait until every queued edit is saved or has failed; False if some are still pending."""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.pending and self.saving is None, timeout)
+
+    def finish(self, pending, result, error):
+        if error is None:
+            self.client.metrics.increment("edits.saved")
+        else:
+            self.client.metrics.increment("edits.failures")
+            self.logger.error(f"Failed to save {pending.title}: {error}")
+        for request in pending.requests:
+            try:
+                request.resolve(result, error)
+            except Exception:
+                self.logger.exception(f"Edit callback for {pending.title} failed.")
+        with self.condition:
+            self.saving = None
+            self.condition.notify_all()
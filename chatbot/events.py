@@ -0,0 +1,121 @@
+from time import time
+from inspect import signature
+from datetime import datetime
+from functools import lru_cache
+
+@lru_cache(maxsize=None)
+def takes_event(function):
+    return len(signature(function).parameters) > 2
+
+class cached:
+    def __init__(self, func):
+        self.func = func
+        self.slot = f"_{func.__name__}"
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        slot = getattr(owner, self.slot)
+        try:
+            return slot.__get__(instance, owner)
+        except AttributeError:
+            value = self.func(instance)
+            slot.__set__(instance, value)
+            return value
+
+class Event:
+    __slots__ = ("client", "data", "received", "_name", "_key", "_user", "_time", "_timestamp")
+
+    def __init__(self, client, data):
+        object.__setattr__(self, "client", client)
+        object.__setattr__(self, "data", data)
+        object.__setattr__(self, "received", time())
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    @property
+    def attrs(self):
+        return self.data["attrs"]
+
+    @cached
+    def name(self):
+        return self.attrs["name"]
+
+    @cached
+    def key(self):
+        return self.name.lower()
+
+    @cached
+    def user(self):
+        return self.client.users.get(self.key)
+
+    @cached
+    def time(self):
+        if "timeStamp" in self.attrs:
+            return int(self.attrs["timeStamp"]) / 1000
+        return self.received
+
+    @cached
+    def timestamp(self):
+        return datetime.utcfromtimestamp(self.time)
+
+class MessageEvent(Event):
+    __slots__ = ("_text", "_me", "_body", "_command_name", "_command_args")
+
+    @cached
+    def text(self):
+        return self.attrs["text"]
+
+    @cached
+    def me(self):
+        return self.text.startswith("/me ")
+
+    @cached
+    def body(self):
+        return (self.text[len("/me "):] if self.me else self.text).lstrip()
+
+    @cached
+    def command_name(self):
+        if not self.text.lstrip().startswith("!"):
+            return None
+        return self.text.split(None, 1)[0][1:] or None
+
+    @cached
+    def command_args(self):
+        if self.command_name is None:
+            return None
+        parts = self.text.split(None, 1)
+        return parts[1] if len(parts) > 1 else ""
+
+class JoinEvent(Event):
+    __slots__ = ()
+
+class PartEvent(Event):
+    __slots__ = ()
+
+class KickEvent(Event):
+    __slots__ = ("_moderator",)
+
+    @cached
+    def name(self):
+        return self.attrs["kickedUserName"]
+
+    @cached
+    def moderator(self):
+        return self.attrs["moderatorName"]
+
+class BanEvent(KickEvent):
+    __slots__ = ("_duration",)
+
+    @cached
+    def duration(self):
+        return self.attrs["time"]
+
+    @property
+    def unban(self):
+        return self.duration == 0
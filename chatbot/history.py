@@ -0,0 +1,137 @@
+from array import array
+from collections import namedtuple
+from threading import Lock
+
+Message = namedtuple("Message", ["time", "name", "text", "me"])
+
+class History:
+    """A fixed-size ring of recent chat messages.
+
+    Every column is preallocated, so the buffer never grows past its initial
+    size no matter how busy the chat is: old messages are evicted when either
+    the message slots or the text buffer run out.
+    """
+
+    def __init__(self, max_messages=5000, max_bytes=1 << 20, max_text=2048):
+        self.capacity = max_messages
+        self.max_text = min(max_text, max_bytes)
+        self.times = array("d", [0]) * max_messages
+        self.authors = array("I", [0]) * max_messages
+        self.starts = array("Q", [0]) * max_messages
+        self.lengths = array("H" if self.max_text < 1 << 16 else "I", [0]) * max_messages
+        self.previous = array("q", [-1]) * max_messages
+        self.flags = bytearray(max_messages)
+        self.text = bytearray(max_bytes)
+        self.head = 0
+        self.tail = 0
+        self.written = 0
+        self.ids = {}
+        self.names = []
+        self.refs = array("I")
+        self.free = []
+        self.last = {}
+        self.lock = Lock()
+
+    def __len__(self):
+        return self.head - self.tail
+
+    @property
+    def nbytes(self):
+        columns = (self.times, self.authors, self.starts, self.lengths, self.previous, self.refs)
+        return sum(column.itemsize * len(column) for column in columns) + len(self.flags) + len(self.text)
+
+    def intern(self, name):
+        key = name.lower()
+        uid = self.ids.get(key)
+        if uid is None:
+            if self.free:
+                uid = self.free.pop()
+                self.names[uid] = name
+            else:
+                uid = len(self.names)
+                self.names.append(name)
+                self.refs.append(0)
+            self.ids[key] = uid
+        self.refs[uid] += 1
+        return uid
+
+    def evict(self):
+        slot = self.tail % self.capacity
+        uid = self.authors[slot]
+        self.refs[uid] -= 1
+        if not self.refs[uid]:
+            del self.ids[self.names[uid].lower()]
+            del self.last[uid]
+            self.names[uid] = None
+            self.free.append(uid)
+        self.tail += 1
+
+    def add(self, timestamp, name, text, me=False):
+        data = text.encode("utf-8")[:self.max_text]
+        size = len(self.text)
+        with self.lock:
+            while len(self) >= self.capacity or (
+                len(self) and self.written + len(data) - self.starts[self.tail % self.capacity] > size
+            ):
+                self.evict()
+            slot = self.head % self.capacity
+            uid = self.intern(name)
+            position = self.written % size
+            end = position + len(data)
+            if end <= size:
+                self.text[position:end] = data
+            else:
+                self.text[position:] = data[:size - position]
+                self.text[:end - size] = data[size - position:]
+            self.times[slot] = timestamp
+            self.authors[slot] = uid
+            self.starts[slot] = self.written
+            self.lengths[slot] = len(data)
+            self.flags[slot] = me
+            self.previous[slot] = self.last.get(uid, -1)
+            self.last[uid] = self.head
+            self.written += len(data)
+            self.head += 1
+
+    def read(self, seq):
+        slot = seq % self.capacity
+        size = len(self.text)
+        position = self.starts[slot] % size
+        end = position + self.lengths[slot]
+        if end <= size:
+            data = self.text[position:end]
+        else:
+            data = self.text[position:] + self.text[:end - size]
+        text = data.decode("utf-8", "ignore")
+        return Message(self.times[slot], self.names[self.authors[slot]], text, bool(self.flags[slot]))
+
+    def sequence(self, name=None):
+        if name is None:
+            return range(self.head - 1, self.tail - 1, -1)
+        return self.chain(self.last.get(self.ids.get(name.lower()), -1))
+
+    def chain(self, seq):
+        while seq >= self.tail:
+            yield seq
+            seq = self.previous[seq % self.capacity]
+
+    def recent(self, name=None, limit=None, predicate=None):
+        """Return up to limit messages, newest first, optionally by one user only."""
+        messages = []
+        with self.lock:
+            for seq in self.sequence(name):
+                message = self.read(seq)
+                if predicate is None or predicate(message):
+                    messages.append(message)
+                    if limit is not None and len(messages) >= limit:
+                        break
+        return messages
+
+    def latest(self, name=None, predicate=None):
+        messages = self.recent(name, 1, predicate)
+        return messages[0] if messages else None
+
+    def count(self, name):
+        with self.lock:
+            uid = self.ids.get(name.lower())
+            return 0 if uid is None else self.refs[uid]
@@ -0,0 +1,72 @@
+import logging
+from threading import BoundedSemaphore, Lock
+from time import monotonic
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+class HTTPClient:
+    def __init__(self, metrics, timeout=(3.05, 10), max_per_host=4, pool_hosts=16, http2=False):
+        self.metrics = metrics
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.logger = logging.getLogger(f"{__package__}.HTTPClient")
+        self.limits = {}
+        self.lock = Lock()
+        self.session = None
+        if http2:
+            if httpx is None:
+                self.logger.warning("HTTP/2 requires httpx[http2], falling back to HTTP/1.1.")
+            else:
+                try:
+                    self.session = httpx.Client(
+                        http2=True,
+                        timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+                        limits=httpx.Limits(max_connections=pool_hosts * max_per_host),
+                    )
+                except ImportError:
+                    self.logger.warning("HTTP/2 requires the h2 package, falling back to HTTP/1.1.")
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=max_per_host)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+
+    def limit(self, host):
+        with self.lock:
+            semaphore = self.limits.get(host)
+            if semaphore is None:
+                semaphore = self.limits[host] = BoundedSemaphore(self.max_per_host)
+            return semaphore
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        if isinstance(self.session, requests.Session):
+            kwargs.setdefault("timeout", self.timeout)
+        with self.limit(host):
+            started = monotonic()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except Exception:
+                self.metrics.increment(f"http.{host}.errors")
+                raise
+            finally:
+                self.metrics.observe(f"http.{host}", monotonic() - started)
+        self.metrics.increment(f"http.{host}.{response.status_code}")
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,445 @@
+import pickle
+import logging
+import traceback
+import multiprocessing
+from itertools import count
+from logging.handlers import QueueHandler
+from threading import Event, Lock, Thread
+
+import requests
+
+from .page import Page
+from .edits import EditQueue
+from .http import HTTPClient
+from .metrics import Metrics
+from .history import History
+from .scheduler import Scheduler
+from .users import User, Rank, RankError
+from .plugins import Command, ArgumentError
+from .events import MessageEvent, JoinEvent, PartEvent, KickEvent, BanEvent, takes_event
+
+EVENTS = {
+    "on_join": JoinEvent,
+    "on_logout": PartEvent,
+    "on_kick": KickEvent,
+    "on_ban": BanEvent,
+    "on_message": MessageEvent,
+}
+FORWARDED = {"send", "send_message", "kick", "ban"}
+
+class WorkerError(Exception):
+    pass
+
+class WorkerUnavailable(WorkerError):
+    """The worker is restarting or gone; nothing was sent."""
+
+class PipeHandler(QueueHandler):
+    def __init__(self, client):
+        super().__init__(None)
+        self.client = client
+
+    def enqueue(self, record):
+        self.client.post(("log", record.__dict__))
+
+class RemoteClient:
+    """The client an isolated plugin sees inside its worker process."""
+
+    def __init__(self, connection, username, site, cookies, http2):
+        self.connection = connection
+        self.lock = Lock()
+        self.username = username
+        self.site = site
+        self.user = User(username, None, False)
+        self.users = {}
+        self.plugins = []
+        self.session = requests.Session()
+        self.session.cookies.update(cookies)
+        self.metrics = Metrics()
+        self.scheduler = Scheduler(self.metrics)
+        self.http = HTTPClient(self.metrics, http2=http2)
+        self.history = History()
+        self.edits = EditQueue(self)
+
+    def post(self, message):
+        with self.lock:
+            self.connection.send(message)
+
+    def forward(self, method, *args):
+        self.post(("call", method, args))
+
+    def send(self, attrs):
+        self.forward("send", attrs)
+
+    def send_message(self, text):
+        self.forward("send_message", text)
+
+    def kick(self, username):
+        self.forward("kick", username)
+
+    def ban(self, username, duration, reason):
+        self.forward("ban", username, duration, reason)
+
+    def open_page(self, title, content=True):
+        return Page(self, title, content)
+
+    def load_users(self, users):
+        self.users = {user.name.lower(): user for user in users}
+        self.user = self.users.get(self.username.lower(), self.user)
+
+    def track(self, hook, data):
+        if hook == "on_join":
+            user = User(data["attrs"]["name"], Rank.from_attrs(data["attrs"]))
+            self.users[user.name.lower()] = user
+            if user.name == self.username:
+                self.user = user
+        elif hook == "on_initial":
+            for user in self.users.values():
+                user.connected = False
+            for model in data["collections"]["users"]["models"]:
+                attrs = model["attrs"]
+                self.users[attrs["name"].lower()] = User(attrs["name"], Rank.from_attrs(attrs))
+        elif hook == "on_message":
+            event = MessageEvent(self, data)
+            self.history.add(event.time, event.name, event.body, event.me)
+        elif hook == "on_logout":
+            user = self.users.get(data["attrs"]["name"].lower())
+            if user is not None:
+                user.connected = False
+
+def declared_filters(cls):
+    filters = {}
+    for hook in EVENTS:
+        declared = getattr(getattr(cls, hook, None), "filter", None)
+        if declared is not None:
+            filters[hook] = declared
+    return filters
+
+def compile_filters(filters):
+    return {hook: declared.compile() for hook, declared in filters.items()}
+
+def describe(plugin):
+    return {name: (command.min_rank, command.args, command.doc) for name, command in plugin.commands.items()}
+
+def serve(connection, cls, init_args, name, username, site, cookies, http2, level):
+    client = RemoteClient(connection, username, site, cookies, http2)
+    logging.root.handlers[:] = [PipeHandler(client)]
+    logging.root.setLevel(level)
+    logger = logging.getLogger(name)
+    args, kwargs = init_args
+    plugin = cls(*args, **kwargs)
+    client.scheduler.start()
+    client.edits.start()
+    plugin.on_load(client, logger)
+    client.plugins.append((plugin, logger))
+    declared = declared_filters(type(plugin))
+    client.post(("ready", describe(plugin), {hook: declared[hook].without_plugin() for hook in declared}))
+    filters = {hook: declared[hook].compile(plugin) for hook in declared}
+
+    def run(kind, *args):
+        if kind == "hook":
+            hook, data = args
+            if data is None:
+                return getattr(plugin, hook)()
+            method = getattr(plugin, hook)
+            if hook not in EVENTS:
+                return method(data)
+            event = EVENTS[hook](client, data)
+            if filters.get(hook) is not None and not filters[hook](event):
+                return None
+            if takes_event(getattr(type(plugin), hook)):
+                return method(data, event)
+            return method(data)
+        if kind == "command":
+            data, = args
+            event = MessageEvent(client, data)
+            return plugin.commands[event.command_name](plugin, client.users, data, event)
+        if kind == "check":
+            username, command_name, min_rank = args
+            user = client.users.get(username.lower()) or User(username, None, False)
+            # Commands of other plugins only exist in the parent; describe them the same way.
+            command = plugin.commands.get(command_name) or RemoteCommand(command_name, min_rank, [], None)
+            return plugin.check_command(user, command)
+        if kind == "export":
+            return plugin.export_state() if hasattr(plugin, "export_state") else None
+        if kind == "import":
+            state, = args
+            if state is not None and hasattr(plugin, "import_state"):
+                plugin.import_state(state)
+            return None
+        raise WorkerError(f"Unknown request {kind}.")
+
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            break
+        if message[0] == "stop":
+            break
+        if message[0] == "users":
+            client.load_users(message[1])
+            continue
+        if message[0] == "track":
+            client.track(message[1], message[2])
+            continue
+        if message[0] == "cookies":
+            client.session.cookies.update(message[1])
+            continue
+        kind, call_id, *args = message
+        try:
+            result = run(kind, *args)
+        except Exception as e:
+            e.remote_traceback = traceback.format_exc()
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = WorkerError(f"{type(e).__name__}: {e}")
+                e.remote_traceback = traceback.format_exc()
+            client.post(("result", call_id, None, e))
+        else:
+            client.post(("result", call_id, result, None))
+    plugin.on_unload()
+    client.edits.drain(5)
+    client.scheduler.stop()
+
+class RemoteCommand(Command):
+    def __init__(self, name, min_rank, args, doc):
+        self.name = name
+        self.min_rank = min_rank
+        self.args = args
+        self.doc = doc
+        self.handler = None
+
+    def __call__(self, plugin, users, data, event=None):
+        try:
+            plugin.call("command", data)
+        except WorkerUnavailable:
+            plugin.client.metrics.increment(f"isolation.{plugin.name}.dropped")
+
+class IsolatedPlugin:
+    """Runs a plugin in a worker process and proxies hooks to it with deadlines.
+
+    The worker builds its own instance from the plugin's class and constructor
+    arguments, so the instance given here only has to be a template. Its wiki
+    edits go through the worker's own EditQueue, paced separately from the bot's.
+    Commands and event filters are refreshed from the worker when it starts, so
+    they follow the code it actually loaded.
+    """
+
+    def __init__(self, plugin, timeout=5, max_restart_delay=60):
+        self.cls = type(plugin)
+        self.init_args = getattr(plugin, "init_args", ((), {}))
+        self.name = self.cls.__name__
+        if not plugin.ISOLATABLE:
+            raise WorkerError(f"{self.name} needs the bot itself and cannot run in a worker.")
+        try:
+            pickle.dumps((self.cls, self.init_args))
+        except Exception as e:
+            raise WorkerError(f"{self.name} cannot be sent to a worker: {e}") from e
+        self.PRIORITY = plugin.PRIORITY
+        self.commands = {name: RemoteCommand(name, *info) for name, info in describe(plugin).items()}
+        self.filters = compile_filters(declared_filters(self.cls))
+        self.timeout = timeout
+        self.max_restart_delay = max_restart_delay
+        self.restart_delay = 1
+        self.client = None
+        self.logger = None
+        self.context = multiprocessing.get_context("spawn")
+        self.process = None
+        self.connection = None
+        self.send_lock = Lock()
+        self.restart_lock = Lock()
+        self.pending = {}
+        self.counter = count()
+        self.stopping = False
+
+    def on_load(self, client, logger):
+        self.client = client
+        self.logger = logger
+        self.stopping = False
+        self.spawn()
+
+    def on_unload(self):
+        self.stopping = True
+        self.kill(graceful=True)
+
+    def spawn(self):
+        parent, child = self.context.Pipe()
+        process = self.context.Process(
+            target=serve,
+            args=(child, self.cls, self.init_args, self.logger.name, self.client.username, self.client.site,
+                  self.client.session.cookies, not isinstance(self.client.http.session, requests.Session), self.logger.getEffectiveLevel()),
+            name=f"plugin-{self.name}",
+            daemon=True,
+        )
+        process.start()
+        child.close()
+        self.process = process
+        self.connection = parent
+        Thread(target=self.read, args=(process, parent), name=f"plugin-{self.name}-reader", daemon=True).start()
+        self.post(("users", list(self.client.users.values())))
+        self.client.metrics.increment(f"isolation.{self.name}.starts")
+
+    def kill(self, graceful=False):
+        process, connection = self.process, self.connection
+        if process is None:
+            return
+        self.process = self.connection = None
+        if graceful:
+            try:
+                with self.send_lock:
+                    connection.send(("stop",))
+                process.join(self.timeout)
+            except OSError:
+                pass
+        if process.is_alive():
+            process.kill()
+            process.join()
+        connection.close()
+        for waiter in list(self.pending.values()):
+            waiter[2] = WorkerError(f"{self.name} worker was stopped.")
+            waiter[0].set()
+
+    def restart(self, reason, graceful=False):
+        with self.restart_lock:
+            if self.stopping:
+                return
+            state = None
+            if graceful:
+                try:
+                    state = self.call("export", restart=False)
+                except WorkerError as e:
+                    self.logger.warning(f"Could not export state: {e}")
+            self.logger.log(logging.INFO if graceful else logging.WARNING, f"Restarting worker: {reason}.")
+            self.client.metrics.increment(f"isolation.{self.name}.restarts")
+            self.kill(graceful)
+            self.spawn()
+            if state is not None:
+                self.post(("import", next(self.counter), state))
+            if self.client.sio.connected:
+                self.post(("hook", next(self.counter), "on_connect", None))
+
+    def schedule_restart(self, reason):
+        delay = self.restart_delay
+        self.restart_delay = min(self.restart_delay * 2, self.max_restart_delay)
+        self.client.scheduler.call_later(delay, self.restart, reason, persistent=True)
+
+    def post(self, message):
+        with self.send_lock:
+            if self.connection is None:
+                raise WorkerUnavailable(f"{self.name} worker is not running.")
+            try:
+                self.connection.send(message)
+            except OSError as e:
+                raise WorkerUnavailable(f"{self.name} worker is unreachable: {e}") from e
+
+    def read(self, process, connection):
+        while True:
+            try:
+                message = connection.recv()
+            except (EOFError, OSError):
+                break
+            kind = message[0]
+            if kind == "result":
+                _, call_id, result, error = message
+                waiter = self.pending.get(call_id)
+                if waiter is not None:
+                    waiter[1], waiter[2] = result, error
+                    waiter[0].set()
+            elif kind == "call":
+                _, method, args = message
+                if method in FORWARDED and self.client.sio.connected:
+                    try:
+                        getattr(self.client, method)(*args)
+                    except Exception:
+                        self.logger.exception(f"Forwarded {method} failed.")
+            elif kind == "log":
+                record = logging.makeLogRecord(message[1])
+                logging.getLogger(record.name).handle(record)
+            elif kind == "ready":
+                self.commands = {name: RemoteCommand(name, *info) for name, info in message[1].items()}
+                self.filters = compile_filters(message[2])
+        if process is self.process and not self.stopping:
+            process.join(self.timeout)
+            self.logger.error(f"Worker exited with code {process.exitcode}.")
+            self.client.metrics.increment(f"isolation.{self.name}.crashes")
+            self.schedule_restart("worker exited")
+
+    def call(self, kind, *args, timeout=None, restart=True):
+        timeout = self.timeout if timeout is None else timeout
+        call_id = next(self.counter)
+        waiter = self.pending[call_id] = [Event(), None, None]
+        try:
+            with self.client.metrics.timer(f"isolation.{self.name}.{kind}"):
+                self.post((kind, call_id) + args)
+                if not waiter[0].wait(timeout):
+                    self.client.metrics.increment(f"isolation.{self.name}.timeouts")
+                    if restart:
+                        self.restart(f"{kind} took longer than {timeout} seconds")
+                    raise WorkerError(f"{self.name} did not answer {kind} within {timeout} seconds.")
+        finally:
+            self.pending.pop(call_id, None)
+        if waiter[2] is not None:
+            if hasattr(waiter[2], "remote_traceback") and not isinstance(waiter[2], (RankError, ArgumentError)):
+                self.logger.error(f"Worker traceback:\n{waiter[2].remote_traceback}")
+            raise waiter[2]
+        self.restart_delay = 1
+        return waiter[1]
+
+    def export_state(self):
+        return self.call("export")
+
+    def import_state(self, state):
+        self.call("import", state)
+
+    def hook(self, hook, data=None):
+        # Events arriving while the worker restarts are dropped rather than failing the hook.
+        try:
+            return self.call("hook", hook, data)
+        except WorkerUnavailable:
+            self.client.metrics.increment(f"isolation.{self.name}.dropped")
+            return None
+
+    def track(self, hook, data):
+        """Keep the worker's users and history current; sent as events arrive, ahead of any queued command."""
+        try:
+            self.post(("track", hook, data))
+        except WorkerError:
+            pass
+
+    def on_connect(self):
+        # The worker may have been started before the bot logged in.
+        self.post(("cookies", self.client.session.cookies))
+        self.hook("on_connect")
+
+    def on_connect_error(self):
+        self.hook("on_connect_error")
+
+    def on_disconnect(self):
+        self.hook("on_disconnect")
+
+    def on_join(self, data):
+        self.hook("on_join", data)
+
+    def on_initial(self, data):
+        self.hook("on_initial", data)
+
+    def on_logout(self, data):
+        self.hook("on_logout", data)
+
+    def on_kick(self, data):
+        self.hook("on_kick", data)
+
+    def on_ban(self, data):
+        self.hook("on_ban", data)
+
+    def on_message(self, data):
+        self.hook("on_message", data)
+
+    def check_command(self, user, command):
+        try:
+            return self.call("check", user.name, command.name, command.min_rank)
+        except WorkerUnavailable:
+            return True
+        except WorkerError as e:
+            self.logger.warning(f"Command check failed: {e}")
+            return True
@@ -0,0 +1,69 @@
+import logging
+from collections import OrderedDict, deque
+from threading import Lock
+from time import monotonic, time
+
+class LatencyTracker:
+    """Matches our messages with their chat:add echoes and measures how long each leg takes.
+
+    Inbound lag is the server's timestamp compared with our receive time, so it
+    includes any clock difference; the echoes of our own messages give a round
+    trip on our clock alone, from which the skew between the clocks is estimated.
+    """
+
+    def __init__(self, metrics, skew_tolerance=2.0, timeout=60, max_pending=100):
+        self.metrics = metrics
+        self.skew_tolerance = skew_tolerance
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.logger = logging.getLogger(f"{__package__}.LatencyTracker")
+        self.pending = OrderedDict()
+        self.skew = None
+        self.skewed = False
+        self.lock = Lock()
+
+    def expire(self, now):
+        while self.pending:
+            text, times = next(iter(self.pending.items()))
+            while times and (now - times[0][0] > self.timeout or len(self.pending) > self.max_pending):
+                times.popleft()
+                self.metrics.increment("latency.unmatched")
+            if times:
+                break
+            del self.pending[text]
+
+    def sent(self, text):
+        now = monotonic()
+        with self.lock:
+            self.pending.setdefault(text, deque()).append((now, time()))
+            self.expire(now)
+
+    def received(self, event):
+        self.metrics.observe("latency.inbound", max(0.0, event.received - event.time))
+        if event.received - event.time < -self.skew_tolerance:
+            self.flag(event.time - event.received)
+        if event.name != event.client.username:
+            return
+        with self.lock:
+            times = self.pending.get(event.text)
+            if not times:
+                return
+            sent_monotonic, sent_time = times.popleft()
+            if not times:
+                del self.pending[event.text]
+        round_trip = monotonic() - sent_monotonic
+        self.metrics.observe("latency.roundtrip", round_trip)
+        skew = event.time - (sent_time + round_trip / 2)
+        self.skew = skew if self.skew is None else 0.8 * self.skew + 0.2 * skew
+        self.metrics.set("latency.skew", self.skew)
+        if abs(self.skew) > self.skew_tolerance + round_trip / 2:
+            self.flag(self.skew)
+        elif self.skewed:
+            self.skewed = False
+            self.logger.info("Clock skew with the chat server is back within %.1f seconds.", self.skew_tolerance)
+
+    def flag(self, skew):
+        self.metrics.increment("latency.skewed")
+        if not self.skewed:
+            self.skewed = True
+            self.logger.warning("The chat server's clock is %.1f seconds %s ours; inbound lag is unreliable.", abs(skew), "ahead of" if skew > 0 else "behind")
@@ -0,0 +1,126 @@
+import sys
+import copy
+import json
+import queue
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+from time import monotonic
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most burst records from the same logging call through per period.
+
+    Records are keyed on where they were logged rather than on the message,
+    since most messages are f-strings that differ on every call.
+    """
+
+    def __init__(self, burst=5, period=60, level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.level = level
+        self.windows = {}
+        self.suppressed = 0
+        self.metrics = None
+        self.lock = Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level:
+            return True
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = monotonic()
+        with self.lock:
+            started, count, dropped = self.windows.get(key, (now, 0, 0))
+            if now - started >= self.period:
+                if dropped:
+                    record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+                started, count, dropped = now, 0, 0
+            if count >= self.burst:
+                self.windows[key] = (started, count, dropped + 1)
+                self.suppressed += 1
+                if self.metrics is not None:
+                    self.metrics.increment("logging.suppressed")
+                return False
+            self.windows[key] = (started, count + 1, dropped)
+            if len(self.windows) > 1000:
+                self.windows = {key: value for key, value in self.windows.items() if now - value[0] < self.period}
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+        self.metrics = None
+
+    def prepare(self, record):
+        # QueueHandler.prepare formats on the calling thread and drops exc_info;
+        # only fix the message here and leave formatting to the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if self.metrics is not None:
+                self.metrics.increment("logging.dropped")
+
+class LogPipeline:
+    """Moves log formatting and I/O off the calling threads onto a single listener thread."""
+
+    def __init__(self, level=logging.WARNING, json_path=None, max_queue=10000, burst=5, period=60, stream=None):
+        self.queue = queue.Queue(max_queue)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.limiter = RateLimitFilter(burst, period)
+        self.handler.addFilter(self.limiter)
+        console = logging.StreamHandler(sys.stderr if stream is None else stream)
+        console.setFormatter(logging.Formatter("[%(levelname)s] %(name)s: %(message)s"))
+        handlers = [console]
+        if json_path is not None:
+            structured = logging.FileHandler(json_path, encoding="utf-8")
+            structured.setFormatter(JSONFormatter())
+            handlers.append(structured)
+        self.handlers = handlers
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.level = level
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    @property
+    def suppressed(self):
+        return self.limiter.suppressed
+
+    def attach(self, metrics):
+        self.handler.metrics = metrics
+        self.limiter.metrics = metrics
+
+    def start(self):
+        logging.root.handlers[:] = [self.handler]
+        logging.root.setLevel(self.level)
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
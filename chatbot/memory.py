@@ -0,0 +1,148 @@
+import os
+import sys
+import logging
+import tracemalloc
+from array import array
+from collections import deque
+from types import ModuleType, FunctionType, MethodType
+
+CONTAINERS = (list, tuple, set, frozenset, deque)
+OPAQUE = (type, ModuleType, FunctionType, MethodType, logging.Logger)
+ATOMS = {str, bytes, bytearray, array, int, float, bool, type(None)}
+
+def deep_size(obj, seen, depth=0):
+    if type(obj) in ATOMS:
+        return sys.getsizeof(obj)
+    if id(obj) in seen or isinstance(obj, OPAQUE):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if depth >= 8:
+        return size
+    if isinstance(obj, dict):
+        for key, value in list(obj.items()):
+            size += deep_size(key, seen, depth + 1) + deep_size(value, seen, depth + 1)
+    elif isinstance(obj, CONTAINERS):
+        for item in list(obj):
+            size += deep_size(item, seen, depth + 1)
+    else:
+        if hasattr(obj, "__dict__"):
+            size += deep_size(vars(obj), seen, depth + 1)
+        for cls in type(obj).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                size += deep_size(getattr(obj, slot, None), seen, depth + 1)
+    return size
+
+def rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+class MemoryProfiler:
+    """Attributes memory to plugins: traced allocations per module and sizes of their data structures."""
+
+    def __init__(self, client, frames=10):
+        self.client = client
+        self.frames = frames
+        self.owners = {}
+        self.previous = {}
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not self.tracing:
+            tracemalloc.start(self.frames)
+
+    def stop(self):
+        tracemalloc.stop()
+        self.previous.pop("allocations", None)
+
+    def groups(self):
+        groups = {os.path.dirname(os.path.abspath(__file__)): "chatbot"}
+        for plugin, _ in self.client.plugins:
+            cls = getattr(plugin, "cls", type(plugin))
+            module = sys.modules.get(cls.__module__)
+            if module is not None and getattr(module, "__file__", None):
+                groups[os.path.abspath(module.__file__)] = cls.__name__
+        for name in ("socketio", "engineio", "requests", "urllib3", "websocket"):
+            module = sys.modules.get(name)
+            if module is not None and getattr(module, "__file__", None):
+                groups[os.path.dirname(os.path.abspath(module.__file__))] = name
+        return groups
+
+    def owner(self, filename, groups):
+        owner = self.owners.get(filename)
+        if owner is None:
+            path = os.path.abspath(filename)
+            owner = groups.get(path)
+            while owner is None and path != os.path.dirname(path):
+                path = os.path.dirname(path)
+                owner = groups.get(path)
+            owner = self.owners[filename] = owner or ""
+        return owner
+
+    def allocations(self):
+        """Traced bytes per owner: the innermost plugin frame of each allocation, else the innermost known library."""
+        if not self.tracing:
+            return {}
+        groups = self.groups()
+        plugins = set(groups.values()) - {"chatbot", "socketio", "engineio", "requests", "urllib3", "websocket"}
+        totals = {}
+        for statistic in tracemalloc.take_snapshot().statistics("traceback"):
+            owner = "other"
+            for frame in reversed(statistic.traceback):
+                found = self.owner(frame.filename, groups)
+                if found in plugins:
+                    owner = found
+                    break
+                if found and owner == "other":
+                    owner = found
+            totals[owner] = totals.get(owner, 0) + statistic.size
+        return totals
+
+    def structures(self):
+        skip = {id(self.client)} | {id(plugin) for plugin, _ in self.client.plugins}
+        sizes = {
+            "users": deep_size(self.client.users, set(skip)),
+            "history": self.client.history.nbytes,
+            "dispatch.queue": deep_size(self.client.dispatcher.heap, set(skip)),
+            "edits.queue": deep_size(self.client.edits.pending, set(skip)),
+        }
+        for plugin, _ in self.client.plugins:
+            for name, value in list(vars(plugin).items()):
+                if name in ("client", "logger") or isinstance(value, (bool, int, float, type(None))):
+                    continue
+                try:
+                    size = deep_size(value, set(skip))
+                except RuntimeError:
+                    continue
+                if size >= 1024:
+                    sizes[f"{type(plugin).__name__}.{name}"] = size
+        return sizes
+
+    def collect(self):
+        """Take a new measurement and return it along with the growth since the previous one."""
+        current = {"allocations": self.allocations(), "structures": self.structures()}
+        report = {"rss": rss(), "tracing": self.tracing}
+        for kind, sizes in current.items():
+            previous = self.previous.get(kind)
+            if previous is None:
+                report[kind] = {name: (size, 0) for name, size in sizes.items()}
+            else:
+                report[kind] = {name: (size, size - previous.get(name, 0)) for name, size in sizes.items()}
+        self.previous.update(current)
+        return report
+
+    def update(self):
+        report = self.collect()
+        metrics = self.client.metrics
+        if report["rss"] is not None:
+            metrics.set("memory.rss", report["rss"])
+        for kind in ("allocations", "structures"):
+            for name, (size, _) in report[kind].items():
+                metrics.set(f"memory.{kind}.{name}", size)
+        return report
@@ -1,29 +1,59 @@
+class EditError(Exception):
+    def __init__(self, code, info, lag=None):
+        super().__init__(f"{code}: {info}")
+        self.code = code
+        self.info = info
+        self.lag = lag
+
 class Page:
-    def __init__(self, client, title):
+    def __init__(self, client, title, content=True):
         self.title = title
         self.client = client
         query = self.client.session.post(self.client.site + "api.php", data={
             "action": "query",
-            "prop": "info|revisions",
+            "prop": "info|revisions" if content else "info",
             "titles": self.title,
             "indexpageids": True,
-            "rvprop": "content",
+            "rvprop": "content|timestamp",
             "intoken": "edit",
             "format": "json",
         }).json()["query"]
         page_id = query["pageids"][0]
         page = query["pages"][page_id]
-        self.content = page["revisions"][0]["*"] if page_id != "-1" else ""
+        self.exists = page_id != "-1" and "missing" not in page
+        self.content = page["revisions"][0]["*"] if content and self.exists else ""
+        self.timestamp = page["revisions"][0].get("timestamp") if content and self.exists else None
+        self.start_timestamp = page.get("starttimestamp")
         self.edit_token = page["edittoken"]
 
-    def save(self, summary=""):
-        self.client.session.post(self.client.site + "api.php", data={
+    def edit(self, summary="", maxlag=None, **params):
+        data = {
             "action": "edit",
             "title": self.title,
-            "text": self.content,
             "token": self.edit_token,
             "bot": True,
             "minor": True,
             "summary": summary,
             "format": "json",
-        }).json()
+            **params,
+        }
+        if maxlag is not None:
+            data["maxlag"] = maxlag
+        response = self.client.session.post(self.client.site + "api.php", data=data).json()
+        if "error" in response:
+            error = response["error"]
+            raise EditError(error.get("code"), error.get("info"), error.get("lag"))
+        return response["edit"]
+
+    def save(self, summary="", maxlag=None):
+        params = {"text": self.content}
+        if self.timestamp is not None:
+            params["basetimestamp"] = self.timestamp
+        if self.start_timestamp is not None:
+            params["starttimestamp"] = self.start_timestamp
+        if not self.exists:
+            params["createonly"] = True
+        return self.edit(summary, maxlag, **params)
+
+    def append(self, text, summary="", maxlag=None):
+        return self.edit(summary, maxlag, appendtext=text)
@@ -1,5 +1,6 @@
+from copy import copy
 from functools import wraps
-from enum import Enum, auto
+from enum import Enum, IntEnum, auto
 from shlex import shlex
 from datetime import datetime
 
@@ -7,6 +8,12 @@ from .users import User, Rank, RankError
 
 stack = []
 
+class Priority(IntEnum):
+    MODERATION = 0
+    COMMAND = 1
+    PASSIVE = 2
+    PREVIEW = 3
+
 def Plugin():
     stack.append({})
     called = False
@@ -17,32 +24,111 @@ def Plugin():
             raise Exception("Plugin is used more than once.")
         called = True
         class Default:
+            PRIORITY = Priority.PASSIVE
+            ISOLATABLE = True
             def on_load(self, client):
                 pass
+            def on_unload(self):
+                pass
             def on_connect(self):
                 pass
             def on_connect_error(self):
                 pass
             def on_disconnect(self):
                 pass
-            def on_join(self, data):
+            def on_join(self, data, event=None):
                 pass
             def on_initial(self, data):
                 pass
-            def on_logout(self, data):
+            def on_logout(self, data, event=None):
                 pass
-            def on_kick(self, data):
+            def on_kick(self, data, event=None):
                 pass
-            def on_ban(self, data):
+            def on_ban(self, data, event=None):
                 pass
-            def on_message(self, data):
+            def on_message(self, data, event=None):
                 pass
+            def check_command(self, user, command):
+                return True
         @wraps(cls, updated=[])
         class Wrapper(cls, Default):
             commands = stack.pop()
+            def __init__(self, *args, **kwargs):
+                # Kept so that an isolated plugin can be constructed again inside its worker.
+                self.init_args = (args, kwargs)
+                super().__init__(*args, **kwargs)
         return Wrapper
     return inner
 
+class Filter:
+    """Declares which events a hook wants, so ChatBot can skip calling it for the rest.
+
+    users is a collection of names, or a function of the plugin returning one;
+    contains (case-insensitive), prefix and urls look at the message text and
+    only apply to on_message. A users function reads the plugin's state, so it
+    is checked separately, where the plugin's hooks run.
+    """
+
+    TEXT_HOOKS = {"on_message"}
+
+    def __init__(self, ignore_self=False, contains=None, prefix=None, urls=False, users=None, min_rank=None):
+        self.ignore_self = ignore_self
+        self.contains = tuple(text.lower() for text in ([contains] if isinstance(contains, str) else contains or ()))
+        if urls:
+            self.contains += ("http",)
+        self.prefix = tuple([prefix] if isinstance(prefix, str) else prefix or ())
+        self.users = users
+        self.min_rank = min_rank
+
+    def __call__(self, function):
+        if (self.contains or self.prefix) and function.__name__ not in self.TEXT_HOOKS:
+            raise ValueError(f"{function.__name__} events have no text to filter on.")
+        function.filter = self
+        return function
+
+    def check_users(self, plugin):
+        """Return a predicate for a users function, or None without one."""
+        if not callable(self.users):
+            return None
+        users = self.users
+        return lambda event: event.name in users(plugin)
+
+    def without_plugin(self):
+        """Return a copy without a users function, which can be pickled."""
+        static = copy(self)
+        if callable(self.users):
+            static.users = None
+        return static
+
+    def compile(self, plugin=None):
+        """Return a predicate on events; without the plugin, a users function is left out."""
+        checks = []
+        if self.ignore_self:
+            checks.append(lambda event: event.name != event.client.username)
+        if self.min_rank is not None:
+            min_rank = self.min_rank
+            checks.append(lambda event: event.user is not None and event.user.rank >= min_rank)
+        if callable(self.users):
+            if plugin is not None:
+                checks.append(self.check_users(plugin))
+        elif self.users is not None:
+            keys = frozenset(name.lower() for name in self.users)
+            checks.append(lambda event: event.key in keys)
+        if self.prefix:
+            prefix = self.prefix
+            checks.append(lambda event: event.text.startswith(prefix))
+        if len(self.contains) == 1:
+            needle, = self.contains
+            checks.append(lambda event: needle in event.text.lower())
+        elif self.contains:
+            needles = self.contains
+            checks.append(lambda event: any(needle in event.text.lower() for needle in needles))
+        if not checks:
+            return None
+        if len(checks) == 1:
+            return checks[0]
+        return lambda event: all(check(event) for check in checks)
+
 class Argument:
     class Kind(Enum):
         IMPLICIT = auto()
@@ -98,7 +184,7 @@ class ArgumentError(Exception):
     pass
 
 class Command:
-    IMPLICIT_ARGUMENTS = ["data", "sender", "timestamp"]
+    IMPLICIT_ARGUMENTS = ["data", "event", "sender", "timestamp"]
 
     def __init__(self, min_rank=Rank.USER, **kwargs):
         self.min_rank = min_rank
@@ -143,13 +229,17 @@ class Command:
         stack[-1][self.name] = self
         return self
 
-    def invoke(self, plugin, users, data):
+    def invoke(self, plugin, users, data, event=None):
         def implicit_value(arg):
             if arg.name == "data":
                 return data
+            if arg.name == "event":
+                return event
             if arg.name == "sender":
                 return user
             if arg.name == "timestamp":
+                if event is not None:
+                    return event.timestamp
                 return datetime.utcfromtimestamp(int(data["attrs"]["timeStamp"]) / 1000)
 
         def explicit_value(arg, value):
@@ -163,14 +253,18 @@ class Command:
             except ValueError:
                 raise ArgumentError(f"Invalid argument: {arg.name}.")
 
-        user = users[data["attrs"]["name"].lower()]
+        if event is None:
+            user = users[data["attrs"]["name"].lower()]
+            message = data["attrs"]["text"].split(None, 1)[1:]
+            message = message[0] if message else ""
+        else:
+            user = event.user
+            message = event.command_args
         if user.rank < self.min_rank:
             raise RankError()
 
-        message = data["attrs"]["text"]
-        lex = shlex(message[1:], posix=True)
+        lex = shlex(message, posix=True)
         lex.whitespace_split = True
-        lex.get_token() # skip command name
 
         explicit_args = list(filter(lambda arg: arg.explicit, self.args))
         has_rest = explicit_args and explicit_args[-1].rest
@@ -180,7 +274,7 @@ class Command:
             except ValueError as e:
                 raise ArgumentError(str(e))
             offset = lex.instream.tell()
-            tokens.append(message[offset + 1:])
+            tokens.append(message[offset:])
         else:
             try:
                 tokens = list(lex)
@@ -0,0 +1,169 @@
+import heapq
+import logging
+from datetime import datetime, timedelta
+from itertools import count
+from random import uniform
+from threading import Condition, Thread, current_thread
+from time import time
+
+class ManualClock:
+    def __init__(self, start=0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+class Cron:
+    def __init__(self, minute=0, hour=None):
+        self.minute = minute
+        self.hour = hour
+
+    def next(self, timestamp):
+        moment = datetime.utcfromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        if self.minute is not None:
+            if moment.minute > self.minute:
+                moment += timedelta(hours=1)
+            moment = moment.replace(minute=self.minute)
+        if self.hour is not None:
+            if moment.hour > self.hour:
+                moment += timedelta(days=1)
+            if moment.hour != self.hour:
+                moment = moment.replace(hour=self.hour, minute=self.minute or 0)
+        return (moment - datetime(1970, 1, 1)).total_seconds()
+
+class Job:
+    def __init__(self, scheduler, callback, args, interval=None, cron=None, jitter=0, persistent=False):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.args = args
+        self.interval = interval
+        self.cron = cron
+        self.jitter = jitter
+        self.persistent = persistent
+        self.name = getattr(callback, "__qualname__", repr(callback))
+        self.nominal = None
+        self.cancelled = False
+
+    def __str__(self):
+        return self.name
+
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    def __init__(self, metrics=None, clock=time):
+        self.metrics = metrics
+        self.clock = clock
+        self.logger = logging.getLogger(f"{__package__}.Scheduler")
+        self.heap = []
+        self.jobs = set()
+        self.counter = count()
+        self.condition = Condition()
+        self.thread = None
+
+    def now(self):
+        return datetime.utcfromtimestamp(self.clock())
+
+    def start(self):
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.thread = Thread(target=self.run, name="scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=10):
+        with self.condition:
+            thread, self.thread = self.thread, None
+            self.condition.notify_all()
+        # A job stopping the scheduler cannot wait for itself; its thread exits once the job returns.
+        if thread is None or thread is current_thread():
+            return
+        thread.join(timeout)
+        if thread.is_alive():
+            self.logger.warning(f"The scheduler thread is still running a job after {timeout} seconds.")
+
+    def push(self, job, nominal):
+        job.nominal = nominal
+        due = nominal + (uniform(0, job.jitter) if job.jitter else 0)
+        with self.condition:
+            self.jobs.add(job)
+            heapq.heappush(self.heap, (due, next(self.counter), job))
+            self.condition.notify()
+        return job
+
+    def call_later(self, delay, callback, *args, jitter=0, persistent=False):
+        job = Job(self, callback, args, jitter=jitter, persistent=persistent)
+        return self.push(job, self.clock() + delay)
+
+    def call_every(self, interval, callback, *args, delay=None, jitter=0, persistent=False):
+        job = Job(self, callback, args, interval=interval, jitter=jitter, persistent=persistent)
+        return self.push(job, self.clock() + (interval if delay is None else delay))
+
+    def call_cron(self, callback, *args, minute=0, hour=None, jitter=0, persistent=False):
+        cron = Cron(minute, hour)
+        job = Job(self, callback, args, cron=cron, jitter=jitter, persistent=persistent)
+        return self.push(job, cron.next(self.clock()))
+
+    def cancel_all(self):
+        with self.condition:
+            for job in self.jobs:
+                if not job.persistent:
+                    job.cancel()
+
+    def reschedule(self, job):
+        now = self.clock()
+        if job.cron is not None:
+            nominal = job.cron.next(max(job.nominal, now))
+        else:
+            nominal = job.nominal + job.interval
+            if nominal <= now:
+                missed = int((now - nominal) // job.interval) + 1
+                nominal += missed * job.interval
+                self.logger.warning(f"Job {job} overran, skipping {missed} run(s).")
+                if self.metrics is not None:
+                    self.metrics.increment("scheduler.overruns")
+        self.push(job, nominal)
+
+    def execute(self, job, due):
+        started = self.clock()
+        try:
+            job.callback(*job.args)
+        except:
+            self.logger.exception(f"Job {job} failed.")
+            if self.metrics is not None:
+                self.metrics.increment("scheduler.failures")
+        if self.metrics is not None:
+            self.metrics.observe("scheduler.lateness", max(0, started - due))
+            self.metrics.observe(f"scheduler.{job}", self.clock() - started)
+
+    def run_pending(self, thread=None):
+        while True:
+            with self.condition:
+                if thread is not None and self.thread is not thread:
+                    return
+                if not self.heap or self.heap[0][0] > self.clock():
+                    return
+                due, _, job = heapq.heappop(self.heap)
+                if job.cancelled:
+                    self.jobs.discard(job)
+                    continue
+            self.execute(job, due)
+            if job.cancelled or (job.interval is None and job.cron is None):
+                with self.condition:
+                    self.jobs.discard(job)
+            else:
+                self.reschedule(job)
+
+    def run(self):
+        thread = current_thread()
+        while True:
+            self.run_pending(thread)
+            with self.condition:
+                if self.thread is not thread:
+                    return
+                timeout = self.heap[0][0] - self.clock() if self.heap else None
+                if timeout is None or timeout > 0:
+                    self.condition.wait(timeout)
@@ -0,0 +1,92 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from threading import Thread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chatbot import ChatBot
+
+from plugins.help import HelpPlugin
+from plugins.admin import AdminPlugin
+from plugins.flood import FloodPlugin
+from plugins.log import LogPlugin
+from plugins.seen import SeenPlugin
+from plugins.tell import TellPlugin
+from plugins.hello import HelloPlugin
+from plugins.xo import XOPlugin
+
+from loadtest.server import parse_args, make_server
+
+def serve(server, host, port):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(server.start(host, port))
+    loop.run_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bot end-to-end against the local stand-in server.")
+    parser.add_argument("--duration", type=float, default=60, help="seconds to run; use a large value for soak tests")
+    parser.add_argument("--report", type=float, default=10, help="seconds between reports")
+    parser.add_argument("--upload-interval", type=float, default=30, help="seconds between log uploads")
+    parser.add_argument("--output", help="write the final report as JSON to this file")
+    args = parse_args(parser)
+    logging.basicConfig(format="[%(levelname)s] %(name)s: %(message)s", level=logging.WARNING)
+
+    server = make_server(args)
+    Thread(target=serve, args=(server, args.host, args.port), daemon=True).start()
+    time.sleep(1)
+
+    os.chdir(tempfile.mkdtemp(prefix="chatbot-loadtest-"))
+    bot = ChatBot("LoadTestBot", "password", f"http://{args.host}:{args.port}/")
+    log = LogPlugin()
+    bot.add_plugins(
+        HelpPlugin(),
+        AdminPlugin(),
+        # Thresholds the simulated chatters never reach: the plugin's hooks still run,
+        # but the test measures dispatch throughput rather than kick and ban churn.
+        FloodPlugin(
+            message_limit=(1000, 5),
+            room_message_limit=(100000, 5),
+            duplicate_limit=(1000, 30),
+            join_limit=(1000, 60),
+            room_join_limit=(100000, 10),
+        ),
+        log,
+        SeenPlugin(),
+        TellPlugin(),
+        HelloPlugin(),
+        XOPlugin(),
+    )
+    bot.start()
+    bot.scheduler.call_every(args.upload_interval, log.log_wiki, persistent=True)
+
+    started = time.monotonic()
+    while time.monotonic() - started < args.duration:
+        time.sleep(min(args.report, args.duration - (time.monotonic() - started)))
+        elapsed = time.monotonic() - started
+        stats = dict(server.stats)
+        metrics = bot.metrics.snapshot()
+        round_trip = metrics["histograms"].get("latency.roundtrip", {"count": 0, "sum": 0})
+        print(
+            f"[{elapsed:7.1f}s] chatter messages {stats['messages']} ({stats['messages'] / elapsed:.1f}/s), "
+            f"bot messages {stats['bot_messages']}, replies {stats['replies']}/{stats['commands']} commands, "
+            f"avg reply {stats['reply_latency_sum'] / max(stats['replies'], 1) * 1000:.1f} ms, "
+            f"max reply {stats['reply_latency_max'] * 1000:.1f} ms, "
+            f"avg round trip {round_trip['sum'] / max(round_trip['count'], 1) * 1000:.1f} ms, edits {stats['edits']}, "
+            f"backlog {metrics['gauges'].get('dispatch.backlog', 0)}, "
+            f"reconnects {metrics['counters'].get('reconnect.count', 0)}"
+        )
+    report = {"server": dict(server.stats), "bot": bot.metrics.snapshot()}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    bot.logout()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+import json
+import asyncio
+import logging
+import argparse
+from random import Random
+from itertools import count
+from time import time, monotonic
+from secrets import token_hex
+
+import socketio
+from aiohttp import web
+
+WORDS = "the chat wiki page edit bot hello anyone here today link game fandom admin log what why when".split()
+
+class Chatter:
+    def __init__(self, name, moderator=False):
+        self.name = name
+        self.moderator = moderator
+
+    def attrs(self):
+        return {
+            "name": self.name,
+            "isModerator": self.moderator,
+            "canPromoteModerator": False,
+        }
+
+class FakeFandom:
+    def __init__(
+        self,
+        chatters=100,
+        rate=0.2,
+        latency=0.0,
+        error_rate=0.0,
+        drop_rate=0.0,
+        churn=0.01,
+        seed=0,
+        password=None,
+    ):
+        self.chatter_count = chatters
+        self.rate = rate
+        self.latency = latency
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.churn = churn
+        self.random = Random(seed)
+        self.password = password
+        self.logger = logging.getLogger("loadtest.FakeFandom")
+        self.sio = socketio.AsyncServer(async_mode="aiohttp", cors_allowed_origins="*")
+        self.sio.on("connect", self.on_connect)
+        self.sio.on("disconnect", self.on_disconnect)
+        self.sio.on("message", self.on_message)
+        self.app = web.Application()
+        self.app.router.add_route("*", "/api.php", self.api)
+        self.app.router.add_route("*", "/wikia.php", self.wikia)
+        self.app.router.add_get("/stats", self.get_stats)
+        self.sio.attach(self.app)
+        self.host = None
+        self.ids = count(1)
+        self.revisions = count(1)
+        self.sessions = {}
+        self.keys = {}
+        self.clients = {}
+        self.chatters = {}
+        self.pages = {}
+        self.pending = {}
+        self.stats = {
+            "messages": 0,
+            "bot_messages": 0,
+            "commands": 0,
+            "replies": 0,
+            "reply_latency_sum": 0.0,
+            "reply_latency_max": 0.0,
+            "edits": 0,
+            "failed_requests": 0,
+            "drops": 0,
+            "kicks": 0,
+            "bans": 0,
+        }
+
+    async def delay(self):
+        if self.latency:
+            await asyncio.sleep(self.random.uniform(0, self.latency * 2))
+
+    def fail(self):
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats["failed_requests"] += 1
+            return True
+        return False
+
+    async def params(self, request):
+        params = dict(request.query)
+        if request.method == "POST":
+            params.update(await request.post())
+        return params
+
+    async def api(self, request):
+        await self.delay()
+        if self.fail():
+            return web.Response(status=503, text="Service unavailable")
+        params = await self.params(request)
+        action = params.get("action")
+        if action == "login":
+            return self.login(params)
+        if action == "query":
+            return web.json_response(self.query(params))
+        if action == "edit":
+            return web.json_response(self.edit(request, params))
+        return web.json_response({"error": {"code": "badvalue", "info": f"Unrecognized action {action}."}})
+
+    def login(self, params):
+        if "lgtoken" not in params:
+            return web.json_response({"login": {"result": "NeedToken", "token": token_hex(8)}})
+        if self.password is not None and params.get("lgpassword") != self.password:
+            return web.json_response({"login": {"result": "WrongPass"}})
+        session = token_hex(16)
+        self.sessions[session] = params["lgname"]
+        response = web.json_response({"login": {"result": "Success", "lgusername": params["lgname"]}})
+        response.set_cookie("session", session)
+        return response
+
+    def query(self, params):
+        query = {}
+        if params.get("meta") == "siteinfo":
+            query["wikidesc"] = {"id": 1}
+        if params.get("list") == "allpages":
+            prefix = params.get("apprefix", "")
+            titles = sorted(
+                title for title in self.pages
+                if title.split(":", 1)[-1].startswith(prefix) and title.startswith("Project:")
+            )
+            start = params.get("apcontinue")
+            if start is not None:
+                titles = [title for title in titles if title.split(":", 1)[-1] >= start]
+            limit = int(params.get("aplimit", 10)) if params.get("aplimit", "10") != "max" else 500
+            query["allpages"] = [{"title": title} for title in titles[:limit]]
+            if len(titles) > limit:
+                return {"continue": {"apcontinue": titles[limit].split(":", 1)[-1]}, "query": query}
+        if "titles" in params:
+            props = params.get("prop", "").split("|")
+            pages = {}
+            missing = count(-1, -1)
+            for title in params["titles"].split("|"):
+                page = self.pages.get(title)
+                if page is None:
+                    page_id = str(next(missing))
+                    pages[page_id] = {"title": title, "missing": ""}
+                else:
+                    page_id = str(page["id"])
+                    pages[page_id] = {"title": title, "pageid": page["id"], "lastrevid": page["revision"]}
+                    if "revisions" in props:
+                        pages[page_id]["revisions"] = [{"*": page["content"], "timestamp": page["timestamp"]}]
+                    if "extracts" in props:
+                        pages[page_id]["extract"] = page["content"][:200]
+                if "info" in props:
+                    pages[page_id]["edittoken"] = "+\\"
+                    pages[page_id]["starttimestamp"] = self.timestamp()
+            query["pages"] = pages
+            if params.get("indexpageids"):
+                query["pageids"] = list(pages)
+        return {"query": query}
+
+    @staticmethod
+    def timestamp():
+        return f"{time():.6f}"
+
+    def edit(self, request, params):
+        if request.cookies.get("session") not in self.sessions:
+            return {"error": {"code": "notloggedin", "info": "You must be logged in."}}
+        title = params["title"]
+        page = self.pages.get(title)
+        base = params.get("basetimestamp")
+        if page is not None and base and base < page["timestamp"]:
+            return {"error": {"code": "editconflict", "info": "Edit conflict detected"}}
+        if page is None:
+            page = self.pages[title] = {"id": len(self.pages) + 1, "content": "", "revision": 0, "timestamp": ""}
+        if "appendtext" in params:
+            page["content"] += params["appendtext"]
+        else:
+            page["content"] = params["text"]
+        page["revision"] = next(self.revisions)
+        page["timestamp"] = self.timestamp()
+        self.stats["edits"] += 1
+        return {"edit": {"result": "Success", "title": title, "newrevid": page["revision"]}}
+
+    async def wikia(self, request):
+        await self.delay()
+        if self.fail():
+            return web.Response(status=503, text="Service unavailable")
+        name = self.sessions.get(request.cookies.get("session"))
+        if name is None:
+            return web.json_response({"chatkey": False})
+        key = token_hex(16)
+        self.keys[key] = name
+        return web.json_response({"chatkey": key, "roomId": 1, "chatServerHost": self.host})
+
+    async def get_stats(self, request):
+        stats = dict(self.stats)
+        stats["reply_latency_avg"] = stats["reply_latency_sum"] / stats["replies"] if stats["replies"] else None
+        stats["chatters"] = len(self.chatters)
+        stats["pages"] = len(self.pages)
+        return web.json_response(stats)
+
+    async def emit(self, event, data, to=None):
+        await self.sio.emit("message", {"event": event, "data": json.dumps(data)}, to=to)
+
+    def users(self):
+        return [
+            *({"attrs": chatter.attrs()} for chatter in self.chatters.values()),
+            *({"attrs": Chatter(name, True).attrs()} for name in self.clients.values()),
+        ]
+
+    async def on_connect(self, sid, environ):
+        query = dict(pair.split("=", 1) for pair in environ.get("QUERY_STRING", "").split("&") if "=" in pair)
+        name = self.keys.pop(query.get("key"), None)
+        if name is None:
+            raise socketio.exceptions.ConnectionRefusedError("Invalid chat key.")
+        self.clients[sid] = name
+        await self.emit("join", {"attrs": Chatter(name, True).attrs()})
+
+    async def on_disconnect(self, sid, *args):
+        name = self.clients.pop(sid, None)
+        if name is not None:
+            await self.emit("part", {"attrs": {"name": name}})
+
+    async def on_message(self, sid, data):
+        await self.delay()
+        attrs = json.loads(data)["attrs"]
+        name = self.clients.get(sid)
+        if attrs.get("msgType") == "chat":
+            self.stats["bot_messages"] += 1
+            for chatter, sent in list(self.pending.items()):
+                if attrs["text"].startswith(f"Hello there, {chatter}"):
+                    latency = monotonic() - sent
+                    self.stats["replies"] += 1
+                    self.stats["reply_latency_sum"] += latency
+                    self.stats["reply_latency_max"] = max(self.stats["reply_latency_max"], latency)
+                    del self.pending[chatter]
+            await self.emit("chat:add", {
+                "id": next(self.ids),
+                "attrs": {"name": name, "text": attrs["text"], "timeStamp": int(time() * 1000)},
+            })
+            return
+        command = attrs.get("command")
+        if command == "initquery":
+            await self.emit("initial", {"collections": {"users": {"models": self.users()}}}, to=sid)
+        elif command == "logout":
+            await self.sio.disconnect(sid)
+        elif command in ("kick", "ban"):
+            target = attrs.get("userToKick") or attrs.get("userToBan")
+            self.stats["kicks" if command == "kick" else "bans"] += 1
+            event = {"kickedUserName": target, "moderatorName": name}
+            if command == "ban":
+                event["time"] = attrs.get("time", 0)
+            await self.emit(command, {"attrs": event})
+            if self.chatters.pop(target.lower(), None) is not None:
+                await self.emit("part", {"attrs": {"name": target}})
+
+    async def chatter_join(self, chatter):
+        self.chatters[chatter.name.lower()] = chatter
+        await self.emit("join", {"attrs": chatter.attrs()})
+
+    async def chatter_part(self, chatter):
+        if self.chatters.pop(chatter.name.lower(), None) is not None:
+            await self.emit("part", {"attrs": {"name": chatter.name}})
+
+    def text(self, chatter):
+        roll = self.random.random()
+        if roll < 0.05:
+            self.pending[chatter.name] = monotonic()
+            self.stats["commands"] += 1
+            return "!hello"
+        if roll < 0.07:
+            self.stats["commands"] += 1
+            other = self.random.choice(list(self.chatters.values()))
+            return f"!seen {other.name}"
+        if roll < 0.08:
+            return f"/me {' '.join(self.random.choices(WORDS, k=4))}"
+        if roll < 0.09:
+            return f"look at [[{self.random.choice(WORDS).title()}]]"
+        return " ".join(self.random.choices(WORDS, k=self.random.randint(1, 12)))
+
+    async def simulate(self):
+        roster = [Chatter(f"Chatter {i}", moderator=i % 50 == 0) for i in range(self.chatter_count)]
+        for chatter in roster:
+            self.chatters[chatter.name.lower()] = chatter
+        interval = 1 / max(self.rate * self.chatter_count, 1e-9)
+        while True:
+            await asyncio.sleep(self.random.expovariate(1 / interval))
+            if not self.clients:
+                continue
+            chatter = self.random.choice(roster)
+            if chatter.name.lower() not in self.chatters:
+                await self.chatter_join(chatter)
+                continue
+            if self.random.random() < self.churn:
+                await self.chatter_part(chatter)
+                continue
+            if self.drop_rate and self.random.random() < self.drop_rate:
+                self.stats["drops"] += 1
+                await self.sio.disconnect(next(iter(self.clients)))
+                continue
+            self.stats["messages"] += 1
+            await self.emit("chat:add", {
+                "id": next(self.ids),
+                "attrs": {"name": chatter.name, "text": self.text(chatter), "timeStamp": int(time() * 1000)},
+            })
+
+    async def start(self, host="127.0.0.1", port=8080):
+        self.host = f"{host}:{port}"
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.simulation = asyncio.ensure_future(self.simulate())
+        self.logger.info(f"Listening on http://{self.host}/")
+
+    async def stop(self):
+        self.simulation.cancel()
+        await self.runner.cleanup()
+
+def parse_args(parser=None):
+    parser = parser or argparse.ArgumentParser(description="Local stand-in for the Fandom chat server and MediaWiki API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--chatters", type=int, default=100, help="number of simulated chatters")
+    parser.add_argument("--rate", type=float, default=0.2, help="messages per second per chatter")
+    parser.add_argument("--latency", type=float, default=0.0, help="mean added latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of HTTP requests that fail")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="chance per simulated event to drop the bot's connection")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+def make_server(args):
+    return FakeFandom(
+        chatters=args.chatters,
+        rate=args.rate,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        drop_rate=args.drop_rate,
+        seed=args.seed,
+    )
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format="[%(levelname)s] %(name)s: %(message)s", level=logging.INFO)
+    server = make_server(args)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start(args.host, args.port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        loop.run_until_complete(server.stop())
+
+if __name__ == "__main__":
+    main()
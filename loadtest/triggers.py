@@ -0,0 +1,78 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plugins.triggers import Automaton, normalize
+
+WORDS = [
+    "the", "chat", "wiki", "page", "edit", "hello", "anyone", "here", "what", "about", "game", "news",
+    "link", "bot", "mod", "admin", "thanks", "please", "lol", "ok", "yes", "no", "why", "when",
+]
+
+def make_patterns(count, rng):
+    patterns = set()
+    while len(patterns) < count:
+        word = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+        patterns.add(word if rng.random() < 0.7 else f"{rng.choice(WORDS)} {word}")
+    return sorted(patterns)
+
+def make_messages(count, patterns, rng):
+    messages = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 20))]
+        if rng.random() < 0.05:
+            words.insert(rng.randrange(len(words) + 1), rng.choice(patterns).upper())
+        messages.append(" ".join(words))
+    return messages
+
+def measure(callback, *args):
+    started = time.perf_counter()
+    result = callback(*args)
+    return time.perf_counter() - started, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trigger automaton against per-pattern regular expressions.")
+    parser.add_argument("--patterns", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--regex-messages", type=int, default=200, help="messages to time the regex baseline on")
+    parser.add_argument("--changes", type=int, default=100, help="patterns to add and remove in the incremental update")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    patterns = make_patterns(args.patterns + args.changes, rng)
+    initial, extra = patterns[:args.patterns], patterns[args.patterns:]
+    messages = make_messages(args.messages, initial, rng)
+    normalized = [normalize(message) for message in messages]
+
+    automaton = Automaton()
+    build, _ = measure(automaton.update, {pattern: pattern for pattern in initial})
+    print(f"build {len(initial)} patterns: {build * 1000:.1f} ms, {len(automaton.goto)} nodes")
+
+    changed = {pattern: pattern for pattern in initial[args.changes:] + extra}
+    update, _ = measure(automaton.update, changed)
+    print(f"update (+{args.changes}/-{args.changes}): {update * 1000:.1f} ms")
+    automaton.update({pattern: pattern for pattern in initial})
+
+    elapsed, matches = measure(lambda: sum(1 for text in normalized for _ in automaton.search(text)))
+    print(
+        f"automaton: {len(messages)} messages in {elapsed * 1000:.1f} ms "
+        f"({elapsed / len(messages) * 1e6:.1f} us/message), {matches} matches"
+    )
+
+    regexes = [re.compile(rf"\b{re.escape(pattern)}\b", re.IGNORECASE) for pattern in initial]
+    sample = messages[:args.regex_messages]
+    elapsed, baseline = measure(lambda: sum(1 for text in sample for regex in regexes if regex.search(text)))
+    expected = sum(1 for text in normalized[:args.regex_messages] for _ in automaton.search(text))
+    print(
+        f"re.search per pattern: {len(sample)} messages in {elapsed * 1000:.1f} ms "
+        f"({elapsed / len(sample) * 1e6:.1f} us/message), {baseline} matches (automaton: {expected})"
+    )
+
+if __name__ == "__main__":
+    main()
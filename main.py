@@ -1,19 +1,32 @@
+import os
 import sys
 import json
+import time
+import atexit
+import signal
 import logging
 import argparse
+from threading import Thread
 
 from chatbot import ChatBot, ClientError
+from chatbot.logqueue import LogPipeline
+from chatbot.plugins import Priority
 
 from plugins.help import HelpPlugin
 from plugins.admin import AdminPlugin
+from plugins.flood import FloodPlugin
 from plugins.log import LogPlugin
+from plugins.search import SearchPlugin
 from plugins.seen import SeenPlugin
 from plugins.tell import TellPlugin
 from plugins.hello import HelloPlugin
 from plugins.xo import XOPlugin
+from plugins.activity import ActivityPlugin
+from plugins.history import HistoryPlugin
+from plugins.triggers import TriggerPlugin
 from plugins.twitter import TwitterPlugin
 from plugins.youtube import YouTubePlugin
+from plugins.wikilinks import WikiLinksPlugin
 
 def read_config():
     try:
@@ -23,36 +36,133 @@ def read_config():
         logging.critical("Cannot read config.")
         sys.exit(1)
 
+def write_metrics(bot, path):
+    with open(path, "w") as file:
+        json.dump(bot.metrics.snapshot(), file)
+
+def request_handoff(pid_file, snapshot):
+    try:
+        with open(pid_file) as file:
+            pid = int(file.read())
+    except (FileNotFoundError, ValueError):
+        logging.warning("No running bot to take over from.")
+        return None
+    requested = time.time()
+    os.kill(pid, signal.SIGUSR1)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if os.stat(snapshot).st_mtime >= requested:
+                return pid
+        except FileNotFoundError:
+            pass
+        time.sleep(0.1)
+    # Without a snapshot the old bot may still be writing the plugins' files, so don't run next to it.
+    os.kill(pid, signal.SIGHUP)
+    logging.critical("The running bot did not hand over its state.")
+    sys.exit(1)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose", action="count", default=0)
+    parser.add_argument("--watch", action="store_true", help="reload plugins when their files change")
+    parser.add_argument("--metrics", metavar="FILE", help="periodically write metrics to FILE")
+    parser.add_argument("--log-json", metavar="FILE", help="also write logs to FILE as JSON lines")
+    parser.add_argument("--trace-memory", action="store_true", help="trace allocations per plugin for !memstats and --metrics")
+    parser.add_argument("--snapshot", metavar="FILE", default="snapshot.json.gz", help="state snapshot written on shutdown and restored on start")
+    parser.add_argument("--pid-file", metavar="FILE", default="bot.pid")
+    parser.add_argument("--handoff", action="store_true", help="take over from the running bot without leaving the chat")
     args = parser.parse_args()
 
     level = logging.NOTSET if args.verbose >= 1 else logging.WARNING
-    logging.basicConfig(format="[%(levelname)s] %(name)s: %(message)s", level=level)
+    pipeline = LogPipeline(level, args.log_json)
+    pipeline.start()
+    atexit.register(pipeline.stop)
 
     config = read_config()
+    old_pid = request_handoff(args.pid_file, args.snapshot) if args.handoff else None
     username = config["username"]
     password = config["password"]
     site = f'https://{config["wiki"]}.fandom.com/'
-    bot = ChatBot(username, password, site, socketio_logger=args.verbose >= 2)
-    bot.add_plugins(
+    bot = ChatBot(username, password, site, socketio_logger=args.verbose >= 2, http2=config.get("http2", False))
+    pipeline.attach(bot.metrics)
+    plugins = [
         HelpPlugin(),
         AdminPlugin(),
+        FloodPlugin(),
         LogPlugin(),
+        SearchPlugin(),
         SeenPlugin(),
         TellPlugin(),
         HelloPlugin(),
         XOPlugin(),
+        ActivityPlugin(),
+        HistoryPlugin(),
+        TriggerPlugin(),
         TwitterPlugin(),
-    )
+        WikiLinksPlugin(),
+    ]
     if config.get("youtube"):
-        bot.add_plugin(YouTubePlugin(config["youtube"]))
+        plugins.append(YouTubePlugin(config["youtube"]))
+    isolated = {name.lower() for name in config.get("isolate", [])}
+    try:
+        for plugin in plugins:
+            bot.add_plugin(plugin, isolate=type(plugin).__name__.lower()[:-len("plugin")] in isolated)
+    except ClientError as e:
+        logging.critical(str(e))
+        sys.exit(1)
+    if args.watch:
+        bot.watch_plugins()
+    if args.trace_memory:
+        bot.memory.start()
+    if args.metrics:
+        if args.trace_memory:
+            bot.scheduler.call_every(300, bot.dispatcher.submit, Priority.PASSIVE, bot.memory.update, persistent=True)
+        bot.scheduler.call_every(60, write_metrics, bot, args.metrics, persistent=True)
+    bot.load_snapshot(args.snapshot)
+
+    def save_snapshot(pause=False):
+        try:
+            bot.save_snapshot(args.snapshot, pause=pause)
+        except (ClientError, OSError) as e:
+            logging.error(f"Could not save the snapshot: {e}")
+            bot.resume()
+
+    def shutdown(signum, frame):
+        if bot.paused is None:
+            save_snapshot()
+        bot.logout()
+
+    def detach(signum, frame):
+        bot.detach()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    if hasattr(signal, "SIGUSR1"):
+        # The snapshot waits on the dispatcher, which must not happen inside a signal handler.
+        signal.signal(signal.SIGUSR1, lambda signum, frame: Thread(target=save_snapshot, args=(True,), name="handoff").start())
+        signal.signal(signal.SIGUSR2, detach)
+        signal.signal(signal.SIGHUP, lambda signum, frame: Thread(target=bot.resume, name="resume").start())
     try:
         bot.start()
     except ClientError as e:
         logging.critical(str(e))
         sys.exit(1)
+    if old_pid is not None:
+        if bot.ready.wait(60):
+            os.kill(old_pid, signal.SIGUSR2)
+        else:
+            logging.critical("Could not connect, handing the chat back to the old bot.")
+            save_snapshot(pause=True)
+            os.kill(old_pid, signal.SIGHUP)
+            bot.detach()
+            sys.exit(1)
+    with open(args.pid_file, "w") as file:
+        file.write(str(os.getpid()))
+    try:
+        while not bot.stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        shutdown(None, None)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,321 @@
+import os
+import json
+from time import time
+from array import array
+from threading import Lock
+
+from chatbot.plugins import Plugin, Command, Argument
+
+DAYS = 35
+PERIODS = {"today": 1, "week": 7, "month": 30, "all": None}
+
+def format_duration(seconds):
+    hours, seconds = divmod(int(seconds), 3600)
+    return f"{hours}h {seconds // 60}m"
+
+class UserStats:
+    __slots__ = ("name", "days", "messages", "chars", "day_hours", "hours", "total_messages", "total_chars", "sessions", "online", "online_since")
+
+    def __init__(self, name):
+        self.name = name
+        self.days = array("l", [-1] * DAYS)
+        self.messages = array("L", [0] * DAYS)
+        self.chars = array("L", [0] * DAYS)
+        self.day_hours = array("L", [0] * (DAYS * 24))
+        self.hours = array("L", [0] * 24)
+        self.total_messages = 0
+        self.total_chars = 0
+        self.sessions = 0
+        self.online = 0.0
+        self.online_since = None
+
+    def slot(self, day):
+        slot = day % DAYS
+        if self.days[slot] != day:
+            self.days[slot] = day
+            self.messages[slot] = 0
+            self.chars[slot] = 0
+            for i in range(slot * 24, slot * 24 + 24):
+                self.day_hours[i] = 0
+        return slot
+
+    def count(self, today, days):
+        if days is None:
+            return self.total_messages, self.total_chars
+        messages = chars = 0
+        for day in range(today - days + 1, today + 1):
+            slot = day % DAYS
+            if self.days[slot] == day:
+                messages += self.messages[slot]
+                chars += self.chars[slot]
+        return messages, chars
+
+    def hour_histogram(self, today, days):
+        if days is None:
+            return list(self.hours)
+        histogram = [0] * 24
+        for day in range(today - days + 1, today + 1):
+            slot = day % DAYS
+            if self.days[slot] == day:
+                for hour in range(24):
+                    histogram[hour] += self.day_hours[slot * 24 + hour]
+        return histogram
+
+    def to_json(self):
+        return {
+            "name": self.name,
+            "days": list(self.days),
+            "messages": list(self.messages),
+            "chars": list(self.chars),
+            "day_hours": list(self.day_hours),
+            "hours": list(self.hours),
+            "total_messages": self.total_messages,
+            "total_chars": self.total_chars,
+            "sessions": self.sessions,
+            "online": self.online,
+            "online_since": self.online_since,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        stats = cls(data["name"])
+        stats.days = array("l", data["days"])
+        stats.messages = array("L", data["messages"])
+        stats.chars = array("L", data["chars"])
+        if "day_hours" in data:
+            stats.day_hours = array("L", data["day_hours"])
+        stats.hours = array("L", data["hours"])
+        stats.total_messages = data["total_messages"]
+        stats.total_chars = data["total_chars"]
+        stats.sessions = data["sessions"]
+        stats.online = data["online"]
+        stats.online_since = data.get("online_since")
+        return stats
+
+class ActivityStats:
+    """Room and per-user activity; the recorders and to_json hold the lock, so
+    a snapshot can be taken from any thread.
+
+    Open sessions are saved too, so they survive a reload or a handoff;
+    observed is when the room was last known to be watched.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.users = {}
+        self.observed = None
+        self.days = array("l", [-1] * DAYS)
+        self.hours = array("L", [0] * (DAYS * 24))
+        self.total_hours = array("L", [0] * 24)
+
+    def user(self, name):
+        stats = self.users.get(name.lower())
+        if stats is None:
+            stats = self.users[name.lower()] = UserStats(name)
+        return stats
+
+    def record_message(self, name, text, timestamp):
+        day, seconds = divmod(int(timestamp), 86400)
+        hour = seconds // 3600
+        with self.lock:
+            stats = self.user(name)
+            slot = stats.slot(day)
+            stats.messages[slot] += 1
+            stats.chars[slot] += len(text)
+            stats.day_hours[slot * 24 + hour] += 1
+            stats.hours[hour] += 1
+            stats.total_messages += 1
+            stats.total_chars += len(text)
+            slot = day % DAYS
+            if self.days[slot] != day:
+                self.days[slot] = day
+                for i in range(slot * 24, slot * 24 + 24):
+                    self.hours[i] = 0
+            self.hours[slot * 24 + hour] += 1
+            self.total_hours[hour] += 1
+
+    def record_join(self, name, timestamp):
+        with self.lock:
+            stats = self.user(name)
+            if stats.online_since is None:
+                stats.online_since = timestamp
+                stats.sessions += 1
+
+    def record_leave(self, name, timestamp):
+        with self.lock:
+            stats = self.users.get(name.lower())
+            if stats is not None and stats.online_since is not None:
+                stats.online += max(0, timestamp - stats.online_since)
+                stats.online_since = None
+
+    def reconcile(self, names, timestamp, max_gap):
+        """Match open sessions to the users in the room. After a gap longer than
+        max_gap nobody knows who came and went, so every session is closed at the
+        last observation and the users in the room start new ones."""
+        present = {name.lower(): name for name in names}
+        with self.lock:
+            stale = self.observed is None or timestamp - self.observed > max_gap
+            for key, stats in self.users.items():
+                if stats.online_since is None or (key in present and not stale):
+                    continue
+                if not stale:
+                    end = timestamp
+                elif self.observed is not None:
+                    end = self.observed
+                else:
+                    end = stats.online_since
+                stats.online += max(0, end - stats.online_since)
+                stats.online_since = None
+            for key, name in present.items():
+                stats = self.user(name)
+                if stats.online_since is None:
+                    stats.online_since = timestamp
+                    stats.sessions += 1
+            self.observed = timestamp
+
+    def hour_histogram(self, today, days):
+        if days is None:
+            return list(self.total_hours)
+        histogram = [0] * 24
+        for day in range(today - days + 1, today + 1):
+            slot = day % DAYS
+            if self.days[slot] == day:
+                for hour in range(24):
+                    histogram[hour] += self.hours[slot * 24 + hour]
+        return histogram
+
+    def to_json(self):
+        with self.lock:
+            return {
+                "users": [stats.to_json() for stats in self.users.values()],
+                "days": list(self.days),
+                "hours": list(self.hours),
+                "total_hours": list(self.total_hours),
+                "observed": self.observed,
+            }
+
+    @classmethod
+    def from_json(cls, data):
+        activity = cls()
+        for user in data["users"]:
+            stats = UserStats.from_json(user)
+            activity.users[stats.name.lower()] = stats
+        activity.days = array("l", data["days"])
+        activity.hours = array("L", data["hours"])
+        activity.total_hours = array("L", data["total_hours"])
+        activity.observed = data.get("observed")
+        return activity
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding="utf-8") as activity_file:
+                return cls.from_json(json.load(activity_file))
+        except FileNotFoundError:
+            return cls()
+
+    def save(self, path):
+        with open(f"{path}.tmp", "w", encoding="utf-8") as activity_file:
+            json.dump(self.to_json(), activity_file)
+        os.replace(f"{path}.tmp", path)
+
+@Plugin()
+class ActivityPlugin:
+    def __init__(self, path="activity.json", snapshot_interval=300, session_gap=900):
+        self.client = None
+        self.logger = None
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.session_gap = session_gap
+        self.stats = None
+        self.job = None
+
+    def on_load(self, client, logger):
+        self.client = client
+        self.logger = logger
+        self.stats = ActivityStats.load(self.path)
+
+    def on_unload(self):
+        self.on_disconnect()
+
+    def on_connect(self):
+        self.job = self.client.scheduler.call_every(self.snapshot_interval, self.snapshot)
+
+    def on_disconnect(self):
+        # Sessions stay open; the next initial event settles who is still there.
+        if self.job is not None:
+            self.job.cancel()
+        self.snapshot()
+
+    def snapshot(self):
+        self.stats.observed = time()
+        self.stats.save(self.path)
+
+    def on_initial(self, data):
+        names = [user["attrs"]["name"] for user in data["collections"]["users"]["models"]]
+        self.stats.reconcile(names, time(), self.session_gap)
+
+    def on_join(self, data, event):
+        self.stats.record_join(event.name, event.received)
+
+    def on_logout(self, data, event):
+        self.stats.record_leave(event.name, event.received)
+
+    def on_kick(self, data, event):
+        self.stats.record_leave(event.name, event.received)
+
+    def on_ban(self, data, event):
+        if not event.unban:
+            self.stats.record_leave(event.name, event.received)
+
+    def on_message(self, data, event):
+        self.stats.record_message(event.name, event.text, event.time)
+
+    @Command(sender=Argument(implicit=True), user=Argument(required=False), period=Argument(required=False))
+    def activity(self, sender, user=None, period=None):
+        """Show chat activity for the room or a user over today, week, month or all."""
+        if period is None and user is not None and user.lower() in PERIODS:
+            user, period = None, user
+        if period is None:
+            period = "week"
+        if period.lower() not in PERIODS:
+            self.client.send_message(f"{sender}, the period must be one of: {', '.join(PERIODS)}.")
+            return
+        period = period.lower()
+        days = PERIODS[period]
+        today = int(time()) // 86400
+        label = "in total" if days is None else "today" if days == 1 else f"this {period}"
+
+        if user is None:
+            with self.stats.lock:
+                counts = sorted(
+                    ((stats.count(today, days)[0], stats.name) for stats in self.stats.users.values()),
+                    reverse=True,
+                )
+            total = sum(count for count, _ in counts)
+            if not total:
+                self.client.send_message(f"{sender}, nobody has talked {label}.")
+                return
+            histogram = self.stats.hour_histogram(today, days)
+            hour = max(range(24), key=histogram.__getitem__)
+            top = ", ".join(f"{name} ({count})" for count, name in counts[:3] if count)
+            self.client.send_message(
+                f"{sender}, {total} messages {label}. Most active: {top}. "
+                f"Busiest hour: {hour:02d}:00-{hour:02d}:59 UTC."
+            )
+            return
+
+        stats = self.stats.users.get(user.lower())
+        if stats is None:
+            self.client.send_message(f"{sender}, I have no activity recorded for {user}.")
+            return
+        messages, chars = stats.count(today, days)
+        histogram = stats.hour_histogram(today, days) if messages else stats.hours
+        hour = max(range(24), key=histogram.__getitem__)
+        online = stats.online
+        if stats.online_since is not None:
+            online += time() - stats.online_since
+        self.client.send_message(
+            f"{sender}, {stats.name} sent {messages} messages ({chars} characters) {label}. "
+            f"Usually active around {hour:02d}:00 UTC; {stats.sessions} visits, {format_duration(online)} online in total."
+        )
@@ -1,10 +1,19 @@
 import json
 
+from chatbot import ClientError
 from chatbot.users import User, Rank
 from chatbot.plugins import Plugin, Command, Argument
 
+def format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
 @Plugin()
 class AdminPlugin:
+    ISOLATABLE = False
     def __init__(self):
         self.client = None
         self.logger = None
@@ -91,6 +100,36 @@ class AdminPlugin:
         """Ban a user."""
         self.client.ban(user.name, hours, reason)
 
+    @Command(sender=Argument(implicit=True), plugin=Argument(), min_rank=Rank.MODERATOR)
+    def reload(self, sender, plugin):
+        """Reload a plugin without reconnecting."""
+        try:
+            self.client.reload_plugin(plugin)
+        except ClientError as e:
+            self.logger.exception(f"Failed to reload {plugin}.")
+            self.client.send_message(f"{sender}, {e}")
+            return
+        self.client.send_message(f"{sender}, {plugin} has been reloaded.")
+
+    @Command(sender=Argument(implicit=True), min_rank=Rank.MODERATOR)
+    def memstats(self, sender):
+        """Show memory usage by plugin and data structure and its growth since the last check."""
+        report = self.client.memory.update()
+
+        def top(sizes, count):
+            largest = sorted(sizes.items(), key=lambda item: item[1][0], reverse=True)[:count]
+            return ", ".join(f"{name} {format_size(size)} ({'+' if growth >= 0 else '-'}{format_size(abs(growth))})" for name, (size, growth) in largest)
+
+        message = f"{sender}, "
+        if report["rss"] is not None:
+            message += f"RSS {format_size(report['rss'])}. "
+        if report["tracing"]:
+            message += f"Allocations: {top(report['allocations'], 5)}.\n"
+        else:
+            message += "Allocation tracing is off.\n"
+        message += f"Structures: {top(report['structures'], 5)}."
+        self.client.send_message(message)
+
     @Command(min_rank=Rank.MODERATOR)
     def exit(self):
         """Stop this bot."""
@@ -0,0 +1,185 @@
+from time import monotonic
+
+from chatbot.users import Rank
+from chatbot.plugins import Plugin, Priority
+
+def fingerprint(text):
+    value = 0
+    for char in " ".join(text.casefold().split()):
+        value = (value * 257 + ord(char)) % 0x1FFFFFFFFFFFFFFF
+    return value
+
+class SlidingWindow:
+    __slots__ = ("width", "counts", "slot", "total")
+
+    def __init__(self, seconds, buckets=10):
+        self.width = seconds / buckets
+        self.counts = [0] * buckets
+        self.slot = 0
+        self.total = 0
+
+    def add(self, now, amount=1):
+        slot = int(now // self.width)
+        if slot - self.slot >= len(self.counts):
+            self.counts = [0] * len(self.counts)
+            self.total = 0
+        else:
+            for expired in range(self.slot + 1, slot + 1):
+                i = expired % len(self.counts)
+                self.total -= self.counts[i]
+                self.counts[i] = 0
+        self.slot = max(self.slot, slot)
+        self.counts[slot % len(self.counts)] += amount
+        self.total += amount
+        return self.total
+
+class UserState:
+    __slots__ = ("messages", "joins", "kicks", "hashes", "times", "position", "commands", "last_seen")
+
+    def __init__(self, plugin):
+        self.messages = SlidingWindow(plugin.message_limit[1])
+        self.joins = SlidingWindow(plugin.join_limit[1])
+        self.kicks = SlidingWindow(plugin.repeat_window)
+        self.hashes = [None] * plugin.duplicate_history
+        self.times = [0.0] * plugin.duplicate_history
+        self.position = 0
+        self.commands = {}
+        self.last_seen = 0.0
+
+    def duplicates(self, value, now, seconds):
+        self.hashes[self.position] = value
+        self.times[self.position] = now
+        self.position = (self.position + 1) % len(self.hashes)
+        return sum(
+            1 for other, timestamp in zip(self.hashes, self.times)
+            if other == value and now - timestamp <= seconds
+        )
+
+@Plugin()
+class FloodPlugin:
+    # Counted before queued commands run, so check_command never sees stale counts.
+    PRIORITY = Priority.MODERATION
+
+    def __init__(
+        self,
+        message_limit=(6, 5),
+        room_message_limit=(30, 5),
+        duplicate_limit=(3, 30),
+        join_limit=(4, 60),
+        room_join_limit=(10, 10),
+        repeat_limit=2,
+        repeat_window=3600,
+        ban_duration=3600,
+        cooldowns=None,
+    ):
+        self.client = None
+        self.logger = None
+        self.message_limit = message_limit
+        self.room_message_limit = room_message_limit
+        self.duplicate_limit = duplicate_limit
+        self.duplicate_history = max(duplicate_limit[0] * 2, 8)
+        self.join_limit = join_limit
+        self.room_join_limit = room_join_limit
+        self.repeat_limit = repeat_limit
+        self.repeat_window = repeat_window
+        self.ban_duration = ban_duration
+        self.cooldowns = {"logs": 30, "seen": 10, "search": 10} if cooldowns is None else cooldowns
+        self.users = {}
+        self.room_messages = SlidingWindow(room_message_limit[1])
+        self.room_joins = SlidingWindow(room_join_limit[1])
+        self.join_flood = False
+        self.job = None
+
+    def on_load(self, client, logger):
+        self.client = client
+        self.logger = logger
+
+    def on_connect(self):
+        self.job = self.client.scheduler.call_every(300, self.prune)
+
+    def on_disconnect(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def on_unload(self):
+        self.on_disconnect()
+
+    def prune(self):
+        deadline = monotonic() - max(self.repeat_window, self.join_limit[1], self.duplicate_limit[1])
+        for name, state in list(self.users.items()):
+            if state.last_seen < deadline:
+                self.users.pop(name, None)
+
+    def state(self, username, now):
+        state = self.users.get(username.lower())
+        if state is None:
+            state = self.users[username.lower()] = UserState(self)
+        state.last_seen = now
+        return state
+
+    def exempt(self, username):
+        user = self.client.users.get(username.lower())
+        return user is None or user == self.client.user or (user.rank is not None and user.rank >= Rank.MODERATOR)
+
+    def punish(self, username, state, now, reason):
+        self.logger.info(f"{username}: {reason}.")
+        state.messages = SlidingWindow(self.message_limit[1])
+        state.hashes = [None] * self.duplicate_history
+        if state.kicks.add(now) > self.repeat_limit:
+            self.client.ban(username, self.ban_duration, f"Automatic: {reason}")
+        else:
+            self.client.kick(username)
+
+    def on_join(self, data, event):
+        username = event.name
+        now = monotonic()
+        room_joins = self.room_joins.add(now)
+        # Legitimate users join during a raid too, so a room-wide flood only
+        # tightens the per-user limit instead of punishing everyone joining.
+        flood = room_joins > self.room_join_limit[0]
+        if flood and not self.join_flood:
+            self.logger.warning(f"Join flood: {room_joins} joins in {self.room_join_limit[1]} seconds.")
+        self.join_flood = flood
+        if self.exempt(username):
+            return
+        state = self.state(username, now)
+        limit = self.join_limit[0]
+        if flood:
+            limit = max(1, limit // 2)
+        if state.joins.add(now) > limit:
+            self.client.ban(username, self.ban_duration, "Automatic: join flood")
+
+    def room_capacity(self):
+        # A busy room is not a flood: allow everyone connected to chat at half their own limit.
+        connected = sum(1 for user in self.client.users.values() if user.connected)
+        return connected * self.message_limit[0] / 2 * self.room_message_limit[1] / self.message_limit[1]
+
+    def on_message(self, data, event):
+        username = event.name
+        now = monotonic()
+        room_messages = self.room_messages.add(now)
+        if self.exempt(username):
+            return
+        state = self.state(username, now)
+        limit = self.message_limit[0]
+        if room_messages > self.room_message_limit[0] and room_messages > self.room_capacity():
+            limit = max(1, limit // 2)
+        if state.messages.add(now) > limit:
+            self.punish(username, state, now, "message flood")
+        elif state.duplicates(fingerprint(event.text), now, self.duplicate_limit[1]) >= self.duplicate_limit[0]:
+            self.punish(username, state, now, "repeated messages")
+
+    def check_command(self, user, command):
+        if self.exempt(user.name):
+            return True
+        now = monotonic()
+        state = self.state(user.name, now)
+        if state.messages.add(now, 0) > self.message_limit[0]:
+            return False
+        cooldown = None if command is None else self.cooldowns.get(command.name)
+        if cooldown is None:
+            return True
+        if now - state.commands.get(command.name, -cooldown) < cooldown:
+            return False
+        state.commands[command.name] = now
+        return True
@@ -2,6 +2,7 @@ from chatbot.plugins import Plugin, Command, Argument
 
 @Plugin()
 class HelpPlugin:
+    ISOLATABLE = False
     def __init__(self):
         self.client = None
         self.logger = None
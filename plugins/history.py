@@ -0,0 +1,43 @@
+from random import choice
+from datetime import datetime
+
+from chatbot.plugins import Plugin, Command, Argument
+
+def is_chat(message):
+    return not message.text.lstrip().startswith("!")
+
+def format_message(message):
+    if message.me:
+        return f"* {message.name} {message.text}"
+    return f"<{message.name}> {message.text}"
+
+@Plugin()
+class HistoryPlugin:
+    def __init__(self):
+        self.client = None
+        self.logger = None
+
+    def on_load(self, client, logger):
+        self.client = client
+        self.logger = logger
+
+    @Command(sender=Argument(implicit=True), user=Argument())
+    def last(self, sender, user):
+        """Show the last thing a user said."""
+        message = self.client.history.latest(user, is_chat)
+        if message is None:
+            self.client.send_message(f"{sender}, I don't remember {user} saying anything recently.")
+            return
+        self.client.send_message(
+            f"{sender}, {datetime.utcfromtimestamp(message.time):%H:%M:%S} UTC {format_message(message)}"
+        )
+
+    @Command(sender=Argument(implicit=True), user=Argument(required=False))
+    def quote(self, sender, user=None):
+        """Quote a random recent message, optionally by a specific user."""
+        messages = self.client.history.recent(user, predicate=lambda message: is_chat(message) and message.name != self.client.user.name)
+        if not messages:
+            self.client.send_message(f"{sender}, there is nothing to quote.")
+            return
+        message = choice(messages)
+        self.client.send_message(f'"{message.text}" — {message.name}, {datetime.utcfromtimestamp(message.time):%Y-%m-%d %H:%M} UTC')
@@ -1,106 +1,392 @@
 import os
+import re
+import gzip
 import html
-from datetime import datetime
-from threading import Timer
+import json
+import shutil
+import logging
+from time import time
+from collections import deque, namedtuple
+from datetime import datetime, timezone
+from threading import Lock
 
 from chatbot.plugins import Plugin, Command, Argument, Rank
 
+LogRecord = namedtuple("LogRecord", ["kind", "time", "name", "text", "moderator"])
+
+LINE_REGEX = re.compile(r"\[(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\] (.*)")
+MESSAGE_REGEX = re.compile(r"<([^<>]+)> (.*)")
+STATUS_REGEX = re.compile(r"-!- (.+) has (joined|left) Special:Chat")
+MODERATION_REGEX = re.compile(r"-!- (.+) was (kicked|banned|unbanned) from Special:Chat by (.+)")
+MODERATION_KINDS = {"kicked": "kick", "banned": "ban", "unbanned": "unban"}
+
+class LogParser:
+    """Reads back the lines LogPlugin.log_file writes, one LogRecord per line.
+
+    Names may contain spaces, so /me lines are attributed to the longest name
+    seen so far that fits, falling back to the first word.
+    """
+
+    def __init__(self):
+        self.names = set()
+        self.skipped = 0
+
+    def parse_line(self, line):
+        match = LINE_REGEX.fullmatch(html.unescape(line.rstrip("\n")))
+        if match is None:
+            return None
+        timestamp = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+        rest = match.group(2)
+        message = MESSAGE_REGEX.fullmatch(rest)
+        if message is not None:
+            self.names.add(message.group(1))
+            return LogRecord("message", timestamp, message.group(1), message.group(2), None)
+        status = STATUS_REGEX.fullmatch(rest)
+        if status is not None:
+            self.names.add(status.group(1))
+            return LogRecord("join" if status.group(2) == "joined" else "leave", timestamp, status.group(1), None, None)
+        moderation = MODERATION_REGEX.fullmatch(rest)
+        if moderation is not None:
+            name, action, moderator = moderation.groups()
+            return LogRecord(MODERATION_KINDS[action], timestamp, name, None, moderator)
+        if rest.startswith("* "):
+            rest = rest[2:]
+            names = [name for name in self.names if rest.startswith(f"{name} ")]
+            name = max(names, key=len) if names else rest.split(" ", 1)[0]
+            return LogRecord("me", timestamp, name, rest[len(name) + 1:], None)
+        return None
+
+    def parse(self, content):
+        """Parse the <pre class="ChatLog"> block of a log page, skipping anything else."""
+        start = content.find('<pre class="ChatLog">')
+        if start == -1:
+            return
+        end = content.find("</pre>", start)
+        for line in content[start:len(content) if end == -1 else end].splitlines()[1:]:
+            record = self.parse_line(line)
+            if record is not None:
+                yield record
+            elif line.strip():
+                self.skipped += 1
+
+class LogSpool:
+    def __init__(self, path, max_bytes, max_age, budget):
+        self.pending_path = os.path.join(path, "pending")
+        self.archive_path = os.path.join(path, "archive")
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.budget = budget
+        self.lock = Lock()
+        os.makedirs(self.pending_path, exist_ok=True)
+        os.makedirs(self.archive_path, exist_ok=True)
+
+        self.pending = deque(sorted(os.listdir(self.pending_path)))
+        self.pending_lines = 0
+        for name in self.pending:
+            with open(os.path.join(self.pending_path, name), encoding="utf-8") as segment:
+                self.pending_lines += sum(1 for _ in segment)
+        self.archived = deque(
+            (name, os.path.getsize(os.path.join(self.archive_path, name)))
+            for name in sorted(os.listdir(self.archive_path))
+        )
+        self.archive_size = sum(size for _, size in self.archived)
+        names = [*self.pending, *(name for name, _ in self.archived)]
+        self.sequence = max((int(name.split("-")[0]) for name in names), default=0) + 1
+
+        self.current = None
+        self.current_day = None
+        self.current_size = 0
+        self.current_lines = 0
+        self.current_created = None
+
+    @staticmethod
+    def day(name):
+        return datetime.strptime(name.split("-")[1].split(".")[0], "%Y%m%d")
+
+    def write(self, timestamp, lines):
+        data = "".join(f"{line}\n" for line in lines)
+        with self.lock:
+            if self.current is not None and (
+                self.current_day != timestamp.date()
+                or self.current_size >= self.max_bytes
+                or (datetime.utcnow() - self.current_created).total_seconds() >= self.max_age
+            ):
+                self.seal_current()
+            if self.current is None:
+                self.current = f"{self.sequence:08d}-{timestamp:%Y%m%d}.log"
+                self.current_day = timestamp.date()
+                self.current_created = datetime.utcnow()
+                self.sequence += 1
+            with open(os.path.join(self.pending_path, self.current), "a", encoding="utf-8") as segment:
+                segment.write(data)
+            self.current_size += len(data.encode("utf-8"))
+            self.current_lines += len(lines)
+
+    def seal_current(self):
+        self.pending.append(self.current)
+        self.pending_lines += self.current_lines
+        self.current = None
+        self.current_size = 0
+        self.current_lines = 0
+
+    def seal(self):
+        with self.lock:
+            if self.current is not None:
+                self.seal_current()
+
+    def adopt(self, path, timestamp):
+        with self.lock:
+            name = f"{self.sequence:08d}-{timestamp:%Y%m%d}.log"
+            self.sequence += 1
+            shutil.move(path, os.path.join(self.pending_path, name))
+            with open(os.path.join(self.pending_path, name), encoding="utf-8") as segment:
+                self.pending_lines += sum(1 for _ in segment)
+            self.pending.appendleft(name)
+
+    @property
+    def lines(self):
+        return self.pending_lines + self.current_lines
+
+    def peek(self):
+        with self.lock:
+            # A spool replaced on reload may have archived segments this one still lists.
+            while self.pending and not os.path.exists(os.path.join(self.pending_path, self.pending[0])):
+                self.pending.popleft()
+            return self.pending[0] if self.pending else None
+
+    def read(self, name):
+        with open(os.path.join(self.pending_path, name), encoding="utf-8") as segment:
+            return segment.read()
+
+    def archive(self, name):
+        source = os.path.join(self.pending_path, name)
+        target = os.path.join(self.archive_path, f"{name}.gz")
+        with open(source, "rb") as segment, gzip.open(target, "wb") as archive:
+            shutil.copyfileobj(segment, archive)
+        with open(source, encoding="utf-8") as segment:
+            lines = sum(1 for _ in segment)
+        os.remove(source)
+        with self.lock:
+            self.pending.remove(name)
+            self.pending_lines -= lines
+            size = os.path.getsize(target)
+            self.archived.append((f"{name}.gz", size))
+            self.archive_size += size
+            while self.archive_size > self.budget and self.archived:
+                old_name, old_size = self.archived.popleft()
+                os.remove(os.path.join(self.archive_path, old_name))
+                self.archive_size -= old_size
+
 @Plugin()
 class LogPlugin:
-    def __init__(self):
+    INDEX_TITLE = "Project:Chat/Logs/Index"
+    UNLOAD_TIMEOUT = 30
+
+    def __init__(
+        self,
+        path="logs",
+        max_bytes=64 * 1024,
+        max_age=3600,
+        budget=64 * 1024 * 1024,
+        max_backoff=3600,
+        max_page_bytes=256 * 1024,
+        max_page_lines=4000,
+    ):
         self.client = None
         self.logger = None
-        self.timer = None
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.budget = budget
+        self.max_backoff = max_backoff
+        self.max_page_bytes = max_page_bytes
+        self.max_page_lines = max_page_lines
+        self.spool = None
+        self.shards = {}
+        self.job = None
+        self.retry = None
+        self.failures = 0
+        self.retry_at = None
+        self.uploading = Lock()
         self.last_edit = None
 
     def on_load(self, client, logger):
         self.client = client
         self.logger = logger
+        self.spool = LogSpool(self.path, self.max_bytes, self.max_age, self.budget)
+        if os.path.exists("chat.log"):
+            self.spool.adopt("chat.log", datetime.utcnow())
+        try:
+            with open(os.path.join(self.path, "shards.json"), encoding="utf-8") as shards_file:
+                self.shards = json.load(shards_file)
+        except FileNotFoundError:
+            self.shards = {}
 
-    def on_connect(self):
-        self.schedule_hourly()
+    def export_state(self):
+        return {
+            "failures": self.failures,
+            "retry_at": self.retry_at,
+            "last_edit": None if self.last_edit is None else self.last_edit.timestamp(),
+        }
 
-    def schedule_hourly(self):
-        now = datetime.utcnow()
-        self.timer = Timer(3600 - now.minute * 60 - now.second, self.hourly, args=[now])
-        self.timer.start()
+    def import_state(self, state):
+        self.failures = state["failures"]
+        self.retry_at = state["retry_at"]
+        if state["last_edit"] is not None:
+            self.last_edit = datetime.fromtimestamp(state["last_edit"])
 
-    def hourly(self, started):
-        self.log_wiki(started)
-        self.schedule_hourly()
+    def on_connect(self):
+        self.job = self.client.scheduler.call_cron(self.log_wiki, minute=0)
+        if self.spool.peek() is not None:
+            delay = 0 if self.retry_at is None else max(0, self.retry_at - time())
+            self.retry = self.client.scheduler.call_later(delay, self.log_wiki)
 
     def on_disconnect(self):
-        if self.timer is not None:
-            self.timer.cancel()
-
-    def on_join(self, data):
-        username = data["attrs"]["name"]
-        self.log_file([f"{username} has joined Special:Chat"], f"{{timestamp}} -!- {{line}}", datetime.utcnow())
-
-    def on_logout(self, data):
-        username = data["attrs"]["name"]
-        self.log_file([f"{username} has left Special:Chat"], f"{{timestamp}} -!- {{line}}", datetime.utcnow())
-
-    def on_kick(self, data):
-        username = data["attrs"]["kickedUserName"]
-        moderator = data["attrs"]["moderatorName"]
-        self.log_file([f"{username} was kicked from Special:Chat by {moderator}"], f"{{timestamp}} -!- {{line}}", datetime.utcnow())
-
-    def on_ban(self, data):
-        username = data["attrs"]["kickedUserName"]
-        moderator = data["attrs"]["moderatorName"]
-        action = "unbanned" if data["attrs"]["time"] == 0 else "banned"
-        self.log_file([f"{username} was {action} from Special:Chat by {moderator}"], f"{{timestamp}} -!- {{line}}", datetime.utcnow())
-
-    def on_message(self, data):
-        username = data["attrs"]["name"]
-        message = data["attrs"]["text"]
-        if message.startswith("/me "):
-            username_format = f"* {username}"
-            message = message[len("/me "):]
+        if self.job is not None:
+            self.job.cancel()
+        if self.retry is not None:
+            self.retry.cancel()
+
+    def on_unload(self):
+        self.on_disconnect()
+        # The next instance rebuilds the spool from disk, so let an upload in flight archive its segment first.
+        if self.uploading.acquire(timeout=self.UNLOAD_TIMEOUT):
+            self.uploading.release()
         else:
-            username_format = f"<{username}>"
-        message = message.lstrip()
-        timestamp = datetime.utcfromtimestamp(int(data["attrs"]["timeStamp"]) / 1000)
-        self.log_file(message.splitlines(), f"{{timestamp}} {username_format} {{line}}", timestamp)
+            self.logger.warning(f"An upload was still in flight after {self.UNLOAD_TIMEOUT} seconds.")
+
+    def on_join(self, data, event):
+        self.log_file([f"{event.name} has joined Special:Chat"], f"{{timestamp}} -!- {{line}}", event.timestamp)
+
+    def on_logout(self, data, event):
+        self.log_file([f"{event.name} has left Special:Chat"], f"{{timestamp}} -!- {{line}}", event.timestamp)
+
+    def on_kick(self, data, event):
+        self.log_file([f"{event.name} was kicked from Special:Chat by {event.moderator}"], f"{{timestamp}} -!- {{line}}", event.timestamp)
+
+    def on_ban(self, data, event):
+        action = "unbanned" if event.unban else "banned"
+        self.log_file([f"{event.name} was {action} from Special:Chat by {event.moderator}"], f"{{timestamp}} -!- {{line}}", event.timestamp)
 
-    def log_wiki(self, timestamp):
+    def on_message(self, data, event):
+        username_format = f"* {event.name}" if event.me else f"<{event.name}>"
+        self.log_file(event.body.splitlines(), f"{{timestamp}} {username_format} {{line}}", event.timestamp)
+
+    def log_wiki(self):
+        if not self.uploading.acquire(blocking=False):
+            return
+        if self.retry is not None:
+            self.retry.cancel()
+            self.retry = None
+        self.spool.seal()
+        self.upload_next()
+
+    def upload_next(self):
+        name = self.spool.peek()
+        if name is None:
+            self.uploading.release()
+            return
         try:
-            with open("chat.log", encoding="utf-8") as log_file:
-                log_data = log_file.read()
-        except FileNotFoundError:
+            self.upload(name)
+        except Exception as e:
+            self.upload_failed(name, e)
+
+    def upload_failed(self, name, error):
+        self.failures += 1
+        delay = min(self.max_backoff, 60 * 2 ** (self.failures - 1))
+        self.logger.error(f"Failed to upload {name}, retrying in {delay} seconds.", exc_info=error)
+        self.retry = self.client.scheduler.call_later(delay, self.log_wiki, jitter=delay / 10)
+        self.retry_at = time() + delay
+        self.uploading.release()
+
+    @staticmethod
+    def shard_title(timestamp, shard):
+        if shard == 1:
+            return f"Project:Chat/Logs/{timestamp:%d %B %Y}"
+        return f"Project:Chat/Logs/{timestamp:%d %B %Y}/{shard}"
+
+    def probe_shard(self, timestamp):
+        """Find the last shard of a day from the wiki, for days shards.json doesn't know about."""
+        found = {"shard": 1, "bytes": 0, "lines": 0}
+        number = 1
+        while True:
+            page = self.client.open_page(self.shard_title(timestamp, number))
+            if not page.content:
+                return found
+            found = {"shard": number, "bytes": len(page.content.encode("utf-8")), "lines": page.content.count("\n")}
+            number += 1
+
+    def upload(self, name):
+        """Queue a spooled segment for its day's log page; the rest of the upload continues in uploaded()."""
+        timestamp = self.spool.day(name)
+        log_data = self.spool.read(name)
+        day = f"{timestamp:%Y-%m-%d}"
+        size = len(log_data.encode("utf-8"))
+        lines = log_data.count("\n")
+        shard = self.shards.get(day) or self.probe_shard(timestamp)
+        if shard["bytes"] and (
+            shard["bytes"] + size > self.max_page_bytes or shard["lines"] + lines > self.max_page_lines
+        ):
+            shard = {"shard": shard["shard"] + 1, "bytes": 0, "lines": 0}
+        shard = {"shard": shard["shard"], "bytes": shard["bytes"] + size, "lines": shard["lines"] + lines}
+        title = self.shard_title(timestamp, shard["shard"])
+        created = []
+
+        def insert(content):
+            created[:] = [not content]
+            if content:
+                end = content.rindex("</pre>")
+                return content[:end] + log_data + content[end:]
+            sort_key = f"{timestamp:%Y %m %d}" if shard["shard"] == 1 else f"{timestamp:%Y %m %d} {shard['shard']}"
+            return f'<pre class="ChatLog">\n{log_data}</pre>\n[[Category:Chat logs|{sort_key}]]'
+
+        def saved(result, error):
+            # Runs on the edit queue's thread; finish on the scheduler's like the rest of the upload.
+            self.client.scheduler.call_later(0, self.uploaded, name, timestamp, title, shard, bool(created and created[0]), error, persistent=True)
+
+        self.client.edits.submit(title, insert, "Updating chat logs", saved)
+
+    def uploaded(self, name, timestamp, title, shard, created, error):
+        if error is not None:
+            self.upload_failed(name, error)
             return
-        title = f"Project:Chat/Logs/{timestamp:%d %B %Y}"
-        page = self.client.open_page(title)
-        if page.content:
-            end = page.content.rindex("</pre>")
-            page.content = page.content[:end] + log_data + page.content[end:]
-        else:
-            page.content = f'<pre class="ChatLog">\n{log_data}</pre>\n[[Category:Chat logs|{timestamp:%Y %m %d}]]'
-        page.save("Updating chat logs")
-        os.remove("chat.log")
+        try:
+            if created:
+                label = f"{timestamp:%d %B %Y}" if shard["shard"] == 1 else f"{timestamp:%d %B %Y}, part {shard['shard']}"
+                self.client.edits.append(self.INDEX_TITLE, f"\n* [[{title}|{label}]]", "Indexing chat logs")
+            self.shards = {
+                key: value for key, value in self.shards.items()
+                if (timestamp - datetime.strptime(key, "%Y-%m-%d")).days < 7
+            }
+            self.shards[f"{timestamp:%Y-%m-%d}"] = shard
+            with open(os.path.join(self.path, "shards.json.tmp"), "w", encoding="utf-8") as shards_file:
+                json.dump(self.shards, shards_file)
+            os.replace(os.path.join(self.path, "shards.json.tmp"), os.path.join(self.path, "shards.json"))
+            self.spool.archive(name)
+        except Exception as e:
+            self.upload_failed(name, e)
+            return
+        self.failures = 0
+        self.retry_at = None
         self.last_edit = datetime.utcnow()
+        self.upload_next()
 
     def log_file(self, lines, format, timestamp):
-        timestamp = f"[{timestamp:%Y-%m-%d %H:%M:%S}]"
-        with open("chat.log", "a", encoding="utf-8") as log_file:
-            for line in lines:
-                self.logger.info(html.unescape(format.format(timestamp=timestamp, line=line)))
-                log_file.write(f"{html.escape(format.format(timestamp=timestamp, line=line), quote=False)}\n")
+        formatted = [format.format(timestamp=f"[{timestamp:%Y-%m-%d %H:%M:%S}]", line=line) for line in lines]
+        if self.logger.isEnabledFor(logging.INFO):
+            for line in formatted:
+                self.logger.info(html.unescape(line))
+        self.spool.write(timestamp, [html.escape(line, quote=False) for line in formatted])
 
     @Command(min_rank=Rank.MODERATOR)
     def updatelogs(self):
         """Log the chat now."""
-        self.log_wiki(datetime.utcnow())
+        self.client.scheduler.call_later(0, self.log_wiki)
 
     @Command(sender=Argument(implicit=True))
     def status(self, sender):
         """Report the last time the logs were uploaded and how many lines are currently in the log buffer."""
-        try:
-            with open("chat.log", encoding="utf-8") as log_file:
-                lines = len(log_file.readlines())
-        except FileNotFoundError:
-            lines = 0
+        lines = self.spool.lines
         message = f"{sender}: "
         if self.last_edit is None:
             message += "I haven't updated the logs since I joined here."
@@ -112,12 +398,13 @@ class LogPlugin:
     @Command(sender=Argument(implicit=True), timestamp=Argument(implicit=True))
     def logs(self, sender, timestamp):
         """Get today's chat logs page link."""
-        title = f"Project:Chat/Logs/{timestamp:%d %B %Y}"
-        if not self.client.open_page(title).content:
+        shard = self.shards.get(f"{timestamp:%Y-%m-%d}")
+        if shard is None:
             self.client.send_message(
                 f"{sender}, I have not logged chat yet today. "
                 "Logs from previous days are available [[Project:Chat/Logs|here]]."
             )
             return
 
+        title = self.shard_title(timestamp, shard["shard"])
         self.client.send_message(f"{sender}, today's chat logs are available [[{title}|here]].")
@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import mmap
+import struct
+from heapq import nlargest
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from threading import Condition, Lock, Thread
+
+from chatbot.plugins import Plugin, Command, Argument
+
+WORD_REGEX = re.compile(r"\w+")
+
+def tokenize(text):
+    return WORD_REGEX.findall(text.casefold())
+
+def contains(postings, doc):
+    i = bisect_left(postings, doc)
+    return i < len(postings) and postings[i] == doc
+
+class Segment:
+    MAGIC = b"CIX1"
+    HEADER = struct.Struct("<4sIQ")
+    ENTRY = struct.Struct("<HQI")
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, offset = self.HEADER.unpack_from(self.map, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not an index segment.")
+        self.terms = {}
+        for _ in range(count):
+            length, position, size = self.ENTRY.unpack_from(self.map, offset)
+            offset += self.ENTRY.size
+            self.terms[self.map[offset:offset + length].decode("utf-8")] = (position, size)
+            offset += length
+
+    def postings(self, term):
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        position, size = entry
+        return memoryview(self.map)[position:position + size * 4].cast("I")
+
+    @classmethod
+    def write(cls, path, terms, postings):
+        entries = []
+        with open(f"{path}.tmp", "wb") as file:
+            file.write(cls.HEADER.pack(cls.MAGIC, 0, 0))
+            for term in terms:
+                position = file.tell()
+                size = 0
+                for chunk in postings(term):
+                    file.write(chunk)
+                    size += len(chunk)
+                entries.append((term.encode("utf-8"), position, size))
+            offset = file.tell()
+            for term, position, size in entries:
+                file.write(cls.ENTRY.pack(len(term), position, size))
+                file.write(term)
+            file.seek(0)
+            file.write(cls.HEADER.pack(cls.MAGIC, len(entries), offset))
+        os.replace(f"{path}.tmp", path)
+        return cls(path)
+
+class SearchIndex:
+    def __init__(self, path="search", flush_docs=50000, max_segments=8):
+        self.path = path
+        self.flush_docs = flush_docs
+        self.max_segments = max_segments
+        self.lock = Lock()
+        self.condition = Condition(self.lock)
+        os.makedirs(path, exist_ok=True)
+        try:
+            with open(os.path.join(path, "index.json"), encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            manifest = {"segments": [], "docs": 0, "sequence": 0}
+        self.segments = [Segment(os.path.join(path, name)) for name in manifest["segments"]]
+        self.indexed = manifest["docs"]
+        self.sequence = manifest["sequence"]
+
+        self.messages = open(os.path.join(path, "messages.log"), "a+b")
+        self.offsets = open(os.path.join(path, "offsets.bin"), "a+b")
+        self.docs = self.offsets.seek(0, os.SEEK_END) // 8
+        self.times_file = open(os.path.join(path, "times.bin"), "a+b")
+        self.times_file.seek(0)
+        self.times = array("d", self.times_file.read())
+        self.fill_times()
+        self.buffer = {}
+        self.buffer_start = self.indexed
+        self.frozen = None
+        self.closed = False
+        self.replay()
+
+        self.thread = Thread(target=self.run, name="search-index", daemon=True)
+        self.thread.start()
+
+    def fill_times(self):
+        # Indexes written before times.bin existed get it rebuilt from messages.log.
+        if len(self.times) >= self.docs:
+            return
+        start = len(self.times)
+        self.offsets.seek(start * 8)
+        self.messages.seek(array("Q", self.offsets.read(8))[0])
+        for _ in range(start, self.docs):
+            self.times.append(float(self.messages.readline().split(b"\t", 1)[0]))
+        self.times_file.write(self.times[start:].tobytes())
+        self.times_file.flush()
+
+    def replay(self):
+        if self.indexed >= self.docs:
+            return
+        self.offsets.seek(self.indexed * 8)
+        start = array("Q", self.offsets.read(8))[0]
+        self.messages.seek(start)
+        for doc in range(self.indexed, self.docs):
+            timestamp, name, text = self.messages.readline().decode("utf-8").rstrip("\n").split("\t", 2)
+            self.index(doc, float(timestamp), name, text)
+
+    def index(self, doc, timestamp, name, text):
+        terms = set(tokenize(text))
+        terms.add(f"user:{name.casefold()}")
+        terms.add(f"day:{datetime.utcfromtimestamp(timestamp):%Y-%m-%d}")
+        for term in terms:
+            postings = self.buffer.get(term)
+            if postings is None:
+                postings = self.buffer[term] = array("I")
+            postings.append(doc)
+
+    def add(self, timestamp, name, text):
+        text = " ".join(text.split())
+        with self.lock:
+            offset = self.messages.seek(0, os.SEEK_END)
+            self.messages.write(f"{timestamp}\t{name}\t{text}\n".encode("utf-8"))
+            self.messages.flush()
+            self.offsets.seek(0, os.SEEK_END)
+            self.offsets.write(array("Q", [offset]).tobytes())
+            self.offsets.flush()
+            self.times_file.write(array("d", [timestamp]).tobytes())
+            self.times_file.flush()
+            self.times.append(timestamp)
+            doc = self.docs
+            self.docs += 1
+            self.index(doc, timestamp, name, text)
+            if self.docs - self.buffer_start >= self.flush_docs and self.frozen is None:
+                self.frozen = (self.buffer, self.docs)
+                self.buffer = {}
+                self.buffer_start = self.docs
+                self.condition.notify()
+
+    def save_manifest(self):
+        with open(os.path.join(self.path, "index.json.tmp"), "w", encoding="utf-8") as manifest_file:
+            json.dump({
+                "segments": [os.path.basename(segment.path) for segment in self.segments],
+                "docs": self.indexed,
+                "sequence": self.sequence,
+            }, manifest_file)
+        os.replace(os.path.join(self.path, "index.json.tmp"), os.path.join(self.path, "index.json"))
+
+    def next_segment_path(self):
+        self.sequence += 1
+        return os.path.join(self.path, f"{self.sequence:06d}.seg")
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.frozen is None and len(self.segments) <= self.max_segments and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                frozen = self.frozen
+                segments = list(self.segments)
+                path = self.next_segment_path()
+            if frozen is not None:
+                buffer, docs = frozen
+                segment = Segment.write(path, sorted(buffer), lambda term: [buffer[term]])
+                with self.lock:
+                    self.segments.append(segment)
+                    self.indexed = docs
+                    self.frozen = None
+                    self.save_manifest()
+            else:
+                terms = sorted(set().union(*(segment.terms for segment in segments)))
+                merged = Segment.write(path, terms, lambda term: [
+                    postings for postings in (segment.postings(term) for segment in segments) if postings is not None
+                ])
+                with self.lock:
+                    self.segments = [merged, *self.segments[len(segments):]]
+                    self.save_manifest()
+                for segment in segments:
+                    os.remove(segment.path)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        self.messages.close()
+        self.offsets.close()
+        self.times_file.close()
+
+    def postings(self, term):
+        with self.lock:
+            chunks = [segment.postings(term) for segment in self.segments]
+            if self.frozen is not None:
+                chunks.append(self.frozen[0].get(term))
+            buffered = self.buffer.get(term)
+            if buffered is not None:
+                chunks.append(array("I", buffered))
+        postings = array("I")
+        for chunk in chunks:
+            if chunk is not None:
+                postings.frombytes(memoryview(chunk).cast("B"))
+        return postings
+
+    def read(self, doc):
+        with self.lock:
+            self.offsets.seek(doc * 8)
+            offset = array("Q", self.offsets.read(8))[0]
+            self.messages.seek(offset)
+            timestamp, name, text = self.messages.readline().decode("utf-8").rstrip("\n").split("\t", 2)
+        return datetime.utcfromtimestamp(float(timestamp)), name, text
+
+    def search(self, terms, limit=3):
+        lists = sorted((self.postings(term) for term in terms), key=len)
+        if not lists:
+            return 0, []
+        shortest, rest = lists[0], lists[1:]
+        docs = [doc for doc in shortest if all(contains(postings, doc) for postings in rest)]
+        # Backfilled messages get doc ids after newer ones, so pick the latest by timestamp.
+        latest = nlargest(limit, reversed(docs), key=self.times.__getitem__)
+        return len(docs), [self.read(doc) for doc in latest]
+
+@Plugin()
+class SearchPlugin:
+    def __init__(self, path="search"):
+        self.path = path
+        self.client = None
+        self.logger = None
+        self.index = None
+
+    def on_load(self, client, logger):
+        self.client = client
+        self.logger = logger
+        self.index = SearchIndex(self.path)
+
+    def on_unload(self):
+        self.index.close()
+
+    def on_message(self, data, event):
+        self.index.add(event.time, event.name, event.text)
+
+    @Command(sender=Argument(implicit=True), query=Argument(rest=True))
+    def search(self, sender, query):
+        """Search the chat history; use user:<name> or day:<yyyy-mm-dd> to narrow it down."""
+        terms = []
+        for word in query.split():
+            prefix, _, value = word.partition(":")
+            if value and prefix.lower() in ("user", "day"):
+                terms.append(f"{prefix.lower()}:{value.replace('_', ' ').casefold()}")
+            else:
+                terms.extend(tokenize(word))
+        if not terms:
+            self.client.send_message(f"{sender}, please specify what to search for.")
+            return
+        total, results = self.index.search(terms)
+        if not total:
+            self.client.send_message(f"{sender}, I found nothing matching {query}.")
+            return
+        lines = [f"{sender}, I found {total} message{'' if total == 1 else 's'}, the latest being:"]
+        for timestamp, name, text in results:
+            if len(text) > 100:
+                text = text[:100] + "..."
+            lines.append(f"[{timestamp:%Y-%m-%d %H:%M:%S}] <{name}> {text}")
+        self.client.send_message("\n".join(lines))
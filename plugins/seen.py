@@ -1,4 +1,5 @@
 import json
+from time import time
 from datetime import datetime
 
 from chatbot.users import User
@@ -41,7 +42,7 @@ class SeenPlugin:
         except FileNotFoundError:
             seen = {}
 
-        seen[user.name.lower()] = datetime.utcnow().timestamp()
+        seen[user.name.lower()] = time()
         with open("seen.json", "w", encoding="utf-8") as seen_file:
             json.dump(seen, seen_file)
 
@@ -62,4 +63,4 @@ class SeenPlugin:
         if seen_timestamp is None:
             self.client.send_message(f"I haven't seen {user} since I have been here.")
         else:
-            self.client.send_message(f"I last saw {user} {format_timedelta(timestamp - datetime.fromtimestamp(seen_timestamp))} ago.")
+            self.client.send_message(f"I last saw {user} {format_timedelta(timestamp - datetime.utcfromtimestamp(seen_timestamp))} ago.")
@@ -3,7 +3,7 @@ from datetime import datetime
 from contextlib import contextmanager
 
 from chatbot.users import User
-from chatbot.plugins import Plugin, Command, Argument
+from chatbot.plugins import Plugin, Command, Argument, Filter
 
 @Plugin()
 class TellPlugin:
@@ -31,17 +31,24 @@ class TellPlugin:
         self.client = client
         self.logger = logger
 
-    def on_join(self, data):
-        self.just_joined.add(data["attrs"]["name"])
+    def export_state(self):
+        return {"just_joined": sorted(self.just_joined)}
 
-    def on_message(self, data):
-        username = data["attrs"]["name"]
+    def import_state(self, state):
+        self.just_joined = set(state["just_joined"])
+
+    def on_join(self, data, event):
+        self.just_joined.add(event.name)
+
+    @Filter(users=lambda self: self.just_joined)
+    def on_message(self, data, event):
+        username = event.name
         if username not in self.just_joined:
             return
         self.just_joined.remove(username)
 
         with self.open_tell() as tell:
-            for message in tell.get(username.lower(), []):
+            for message in tell.get(event.key, []):
                 if "delivered" not in message:
                     self.client.send_message(
                         f'{username}, {message["from"]} wanted to tell you @ '
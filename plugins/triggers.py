@@ -0,0 +1,248 @@
+import os
+import json
+from array import array
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+from chatbot.users import Rank
+from chatbot.plugins import Plugin, Command, Argument, Filter
+
+ACTIONS = {"reply": 0, "warn": 1, "kick": 2}
+
+def normalize(text):
+    return " ".join(text.casefold().split())
+
+def is_word(char):
+    return char.isalnum() or char == "_"
+
+class Automaton:
+    """Aho-Corasick automaton over case-folded patterns.
+
+    Patterns can be added and removed in place; the trie keeps its nodes and
+    only the failure links are recomputed, until removed patterns leave more
+    dead nodes than live ones and the trie is compacted.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.goto = [{}]
+        self.fail = array("I", [0])
+        self.link = array("I", [0])
+        self.depth = array("I", [0])
+        self.output = array("i", [-1])
+        self.values = []
+        self.patterns = {}
+        self.free = []
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def __contains__(self, pattern):
+        return normalize(pattern) in self.patterns
+
+    def add(self, pattern, value):
+        pattern = normalize(pattern)
+        if not pattern:
+            return
+        index = self.patterns.get(pattern)
+        if index is not None:
+            self.values[index] = (pattern, value)
+            return
+        node = 0
+        for char in pattern:
+            child = self.goto[node].get(char)
+            if child is None:
+                child = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.link.append(0)
+                self.depth.append(self.depth[node] + 1)
+                self.output.append(-1)
+                self.goto[node][char] = child
+            node = child
+        if self.free:
+            index = self.free.pop()
+            self.values[index] = (pattern, value)
+        else:
+            index = len(self.values)
+            self.values.append((pattern, value))
+        self.output[node] = index
+        self.patterns[pattern] = index
+        self.dirty = True
+
+    def remove(self, pattern):
+        pattern = normalize(pattern)
+        index = self.patterns.pop(pattern, None)
+        if index is None:
+            return
+        node = 0
+        for char in pattern:
+            node = self.goto[node][char]
+        self.output[node] = -1
+        self.values[index] = None
+        self.free.append(index)
+        self.dirty = True
+
+    def update(self, mapping):
+        """Make the automaton hold exactly the patterns in mapping, touching only what changed."""
+        mapping = {normalize(pattern): value for pattern, value in mapping.items()}
+        for pattern in [pattern for pattern in self.patterns if pattern not in mapping]:
+            self.remove(pattern)
+        for pattern, value in mapping.items():
+            self.add(pattern, value)
+        live = sum(len(pattern) for pattern in self.patterns)
+        if len(self.goto) > 2 * live + 1:
+            values = [value for value in self.values if value is not None]
+            self.clear()
+            for pattern, value in values:
+                self.add(pattern, value)
+        self.build()
+
+    def build(self):
+        if not self.dirty:
+            return
+        goto, fail, link, output = self.goto, self.fail, self.link, self.output
+        queue = deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            link[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in goto[node].items():
+                state = fail[node]
+                while state and char not in goto[state]:
+                    state = fail[state]
+                target = goto[state].get(char, 0)
+                fail[child] = target if target != child else 0
+                link[child] = fail[child] if output[fail[child]] >= 0 else link[fail[child]]
+                queue.append(child)
+        self.dirty = False
+
+    def search(self, text):
+        """Yield (start, end, value) for every whole-word match in the normalized text."""
+        goto, fail, link, depth, output, values = self.goto, self.fail, self.link, self.depth, self.output, self.values
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            match = node if output[node] >= 0 else link[node]
+            while match:
+                start = end - depth[match]
+                if (
+                    (start == 0 or not is_word(text[start - 1]) or not is_word(text[start]))
+                    and (end == len(text) or not is_word(text[end]) or not is_word(text[end - 1]))
+                ):
+                    yield start, end, values[output[match]][1]
+                match = link[match]
+
+class Trigger:
+    __slots__ = ("pattern", "action", "response", "last_fired")
+
+    def __init__(self, pattern, action="reply", response=None):
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown action {action}.")
+        self.pattern = pattern
+        self.action = action
+        self.response = response
+        self.last_fired = None
+
+    def __eq__(self, other):
+        return (self.pattern, self.action, self.response) == (other.pattern, other.action, other.response)
+
+@Plugin()
+class TriggerPlugin:
+    def __init__(self, path="triggers.json", poll_interval=10, cooldown=30):
+        self.client = None
+        self.logger = None
+        self.path = path
+        self.poll_interval = poll_interval
+        self.cooldown = cooldown
+        self.automaton = Automaton()
+        self.lock = Lock()
+        self.mtime = None
+        self.job = None
+
+    def on_load(self, client, logger):
+        self.client = client
+        self.logger = logger
+        self.reload()
+
+    def on_unload(self):
+        self.on_disconnect()
+
+    def on_connect(self):
+        self.job = self.client.scheduler.call_every(self.poll_interval, self.reload)
+
+    def on_disconnect(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def reload(self, force=False):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime and not force:
+            return
+        self.mtime = mtime
+        triggers = {}
+        if mtime is not None:
+            try:
+                with open(self.path, encoding="utf-8") as triggers_file:
+                    for entry in json.load(triggers_file):
+                        trigger = Trigger(entry["pattern"], entry.get("action", "reply"), entry.get("response"))
+                        triggers[trigger.pattern] = trigger
+            except (ValueError, KeyError, TypeError) as e:
+                self.logger.error(f"Invalid {self.path}: {e}")
+                return
+        with self.lock:
+            for pattern, trigger in triggers.items():
+                if pattern in self.automaton:
+                    current = self.automaton.values[self.automaton.patterns[normalize(pattern)]][1]
+                    if current == trigger:
+                        trigger.last_fired = current.last_fired
+            self.automaton.update(triggers)
+        self.logger.info(f"Loaded {len(triggers)} triggers.")
+
+    def exempt(self, user):
+        return user is None or user == self.client.user or (user.rank is not None and user.rank >= Rank.MODERATOR)
+
+    @Filter(ignore_self=True)
+    def on_message(self, data, event):
+        if event.command_name is not None:
+            return
+        text = normalize(event.body)
+        with self.lock:
+            matches = [trigger for _, _, trigger in self.automaton.search(text)]
+        if not matches:
+            return
+        trigger = max(matches, key=lambda trigger: ACTIONS[trigger.action])
+        if trigger.action != "reply" and self.exempt(event.user):
+            replies = [trigger for trigger in matches if trigger.action == "reply"]
+            if not replies:
+                return
+            trigger = replies[0]
+        now = monotonic()
+        if trigger.action == "reply":
+            if trigger.last_fired is not None and now - trigger.last_fired < self.cooldown:
+                return
+            trigger.last_fired = now
+            if trigger.response:
+                self.client.send_message(trigger.response.replace("{user}", event.name))
+        elif trigger.action == "warn":
+            self.client.send_message(f"{event.name}, {trigger.response or 'please watch your language.'}")
+        else:
+            self.logger.info(f"Kicking {event.name} for saying {trigger.pattern!r}.")
+            self.client.kick(event.name)
+
+    @Command(sender=Argument(implicit=True), min_rank=Rank.MODERATOR)
+    def triggers(self, sender):
+        """Reload the trigger list."""
+        self.reload(force=True)
+        self.client.send_message(f"{sender}, {len(self.automaton)} triggers are active.")
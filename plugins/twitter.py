@@ -1,8 +1,7 @@
 import re
-import requests
 from html.parser import HTMLParser
 
-from chatbot.plugins import Plugin
+from chatbot.plugins import Plugin, Priority, Filter
 
 class TwitterHTMLParser(HTMLParser):
     def __init__(self):
@@ -41,6 +40,7 @@ class TwitterHTMLParser(HTMLParser):
 
 @Plugin()
 class TwitterPlugin:
+    PRIORITY = Priority.PREVIEW
     URL_REGEX = re.compile(r"(?:https?:\/\/)?(?:www\.)?(?:(?:mobile\.)?twitter\.com)\/(?:#!\/)?(?P<username>\w{1,15})\/status(?:es)?\/(?P<id>\d+)")
 
     def __init__(self):
@@ -51,16 +51,17 @@ class TwitterPlugin:
         self.client = client
         self.logger = logger
 
+    @Filter(ignore_self=True, contains="twitter.com")
     def on_message(self, data):
         message = data["attrs"]["text"]
         for match in self.URL_REGEX.finditer(message):
-            response = requests.get("https://publish.twitter.com/oembed", params={
+            response = self.client.http.get("https://publish.twitter.com/oembed", params={
                 "url": f'https://twitter.com/{match["username"]}/status/{match["id"]}',
                 "hide_media": True,
                 "hide_thread": True,
                 "omit_script": True,
             })
-            if not response.ok:
+            if response.status_code != 200:
                 continue
             response = response.json()
             parser = TwitterHTMLParser()
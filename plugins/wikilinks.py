@@ -0,0 +1,162 @@
+import re
+from time import monotonic
+from datetime import datetime
+from collections import OrderedDict
+from threading import Lock
+
+from chatbot.plugins import Plugin, Priority, Filter
+
+class LinkInfo:
+    __slots__ = ("title", "target", "names", "exists", "revision", "extract", "fetched")
+
+    def __init__(self, title, target, names, exists, revision, extract):
+        self.title = title
+        self.target = target
+        self.names = names
+        self.exists = exists
+        self.revision = revision
+        self.extract = extract
+        self.fetched = monotonic()
+
+    def __str__(self):
+        if not self.exists:
+            return f"[[{self.title}]] doesn't exist."
+        text = f"[[{self.title}]]"
+        if self.target != self.title:
+            text += f" \u2192 [[{self.target}]]"
+        if self.extract:
+            extract = self.extract if len(self.extract) <= 150 else self.extract[:150].rsplit(" ", 1)[0] + "..."
+            text += f": {extract}"
+        return text
+
+@Plugin()
+class WikiLinksPlugin:
+    PRIORITY = Priority.PREVIEW
+    LINK_REGEX = re.compile(r"\[\[([^\[\]{}|#<>]+)(?:#[^\[\]|]*)?(?:\|[^\[\]]*)?\]\]")
+    MAX_TITLES = 50
+
+    def __init__(self, max_links=10, cache_size=2000, ttl=3600, poll_interval=60):
+        self.client = None
+        self.logger = None
+        self.max_links = max_links
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.cache = OrderedDict()
+        # Every title a cached link passed through on the wiki (normalized, redirect, target) -> cache keys.
+        self.names = {}
+        self.lock = Lock()
+        self.last_poll = None
+        self.job = None
+
+    def on_load(self, client, logger):
+        self.client = client
+        self.logger = logger
+
+    def on_unload(self):
+        self.on_disconnect()
+
+    def on_connect(self):
+        self.job = self.client.scheduler.call_every(self.poll_interval, self.poll_changes)
+
+    def on_disconnect(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    @staticmethod
+    def normalize(title):
+        title = " ".join(title.replace("_", " ").split())
+        return title[:1].upper() + title[1:]
+
+    def api(self, **params):
+        params["format"] = "json"
+        return self.client.session.get(self.client.site + "api.php", params=params, timeout=10).json()
+
+    def poll_changes(self):
+        if not self.cache or self.last_poll is None:
+            self.last_poll = f"{datetime.utcnow():%Y-%m-%dT%H:%M:%SZ}"
+            return
+        params = {
+            "action": "query",
+            "list": "recentchanges",
+            "rcprop": "title|ids|timestamp",
+            "rcdir": "newer",
+            "rclimit": "max",
+            "rcstart": self.last_poll,
+        }
+        while True:
+            response = self.api(**params)
+            with self.lock:
+                for change in response.get("query", {}).get("recentchanges", []):
+                    for title in list(self.names.get(change["title"], ())):
+                        if change.get("revid", 0) != self.cache[title].revision:
+                            self.forget(title)
+                    self.last_poll = change["timestamp"]
+            if "continue" not in response:
+                return
+            params.update(response["continue"])
+
+    def forget(self, title):
+        info = self.cache.pop(title)
+        for name in info.names:
+            keys = self.names[name]
+            keys.discard(title)
+            if not keys:
+                del self.names[name]
+
+    def lookup(self, titles):
+        response = self.api(
+            action="query",
+            titles="|".join(titles),
+            redirects=True,
+            prop="info|extracts",
+            exintro=True,
+            explaintext=True,
+            exsentences=1,
+            exlimit="max",
+        ).get("query", {})
+        chains = {title: [title] for title in titles}
+        for mapping in ("normalized", "redirects"):
+            for entry in response.get(mapping, []):
+                for chain in chains.values():
+                    if chain[-1] == entry["from"]:
+                        chain.append(entry["to"])
+        pages = {page["title"]: page for page in response.get("pages", {}).values()}
+        with self.lock:
+            for title, chain in chains.items():
+                target = chain[-1]
+                page = pages.get(target, {"missing": ""})
+                cached = self.cache.get(title)
+                extract = page.get("extract")
+                if extract is None and cached is not None and cached.revision == page.get("lastrevid"):
+                    extract = cached.extract
+                if cached is not None:
+                    self.forget(title)
+                names = frozenset(chain)
+                self.cache[title] = LinkInfo(title, target, names, "missing" not in page and "invalid" not in page, page.get("lastrevid"), extract)
+                for name in names:
+                    self.names.setdefault(name, set()).add(title)
+            while len(self.cache) > self.cache_size:
+                self.forget(next(iter(self.cache)))
+
+    @Filter(ignore_self=True, contains="[[")
+    def on_message(self, data, event):
+        titles = []
+        for match in self.LINK_REGEX.finditer(event.text):
+            title = self.normalize(match[1])
+            if title and title not in titles:
+                titles.append(title)
+        titles = titles[:min(self.max_links, self.MAX_TITLES)]
+        if not titles:
+            return
+        now = monotonic()
+        with self.lock:
+            cached = {title: self.cache.get(title) for title in titles}
+        stale = [title for title, info in cached.items() if info is None or now - info.fetched > self.ttl]
+        if stale:
+            self.lookup(stale)
+            with self.lock:
+                cached = {title: self.cache.get(title) for title in titles}
+        lines = [str(info) for info in cached.values() if info is not None]
+        if lines:
+            self.client.send_message("\n".join(lines))
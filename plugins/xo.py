@@ -1,61 +1,229 @@
+from time import monotonic
 from random import choice
+from functools import lru_cache
+from collections import OrderedDict
 
+from chatbot.users import User
 from chatbot.plugins import Plugin, Command, Argument
 
+FULL = 0b111111111
+WIN_MASKS = (
+    0b000000111, 0b000111000, 0b111000000,
+    0b001001001, 0b010010010, 0b100100100,
+    0b100010001, 0b001010100,
+)
+
+def won(bits):
+    return any(bits & mask == mask for mask in WIN_MASKS)
+
+@lru_cache(maxsize=None)
+def solve(player, opponent):
+    empty = FULL & ~(player | opponent)
+    if won(opponent):
+        return -(bin(empty).count("1") + 1), None
+    if not empty:
+        return 0, None
+    best = None, None
+    for cell in range(9):
+        if empty & (1 << cell):
+            score = -solve(opponent, player | (1 << cell))[0]
+            if best[0] is None or score > best[0]:
+                best = score, cell
+    return best
+
+class Game:
+    __slots__ = ("players", "bits", "turn", "hard", "last_active")
+
+    def __init__(self, players, hard=False):
+        self.players = players
+        self.bits = [0, 0]
+        self.turn = 0
+        self.hard = hard
+        self.last_active = monotonic()
+
+    @property
+    def empty(self):
+        return FULL & ~(self.bits[0] | self.bits[1])
+
+    def play(self, cell):
+        self.bits[self.turn] |= 1 << cell
+        self.turn ^= 1
+        self.last_active = monotonic()
+        return won(self.bits[self.turn ^ 1])
+
+    def bot_move(self):
+        if self.hard:
+            return solve(self.bits[self.turn], self.bits[self.turn ^ 1])[1]
+        empty = self.empty
+        return choice([cell for cell in range(9) if empty & (1 << cell)])
+
+    def __str__(self):
+        def cell(i):
+            if self.bits[0] & (1 << i):
+                return "X"
+            if self.bits[1] & (1 << i):
+                return "O"
+            return str(i + 1)
+        return "\n\u2550\u256c\u2550\u256c\u2550\n".join(
+            "\u2551".join(cell(row * 3 + col) for col in range(3)) for row in range(3)
+        )
+
 @Plugin()
 class XOPlugin:
-    def __init__(self):
+    def __init__(self, max_games=1000, idle_timeout=600):
         self.client = None
         self.logger = None
-        self.board = None
+        self.max_games = max_games
+        self.idle_timeout = idle_timeout
+        self.games = OrderedDict()
+        self.challenges = {}
+        self.job = None
 
     def on_load(self, client, logger):
         self.client = client
         self.logger = logger
+        solve(0, 0)
 
-    @Command(sender=Argument(implicit=True), position=Argument(required=False, type=int))
-    def xo(self, sender, position=None):
-        """Play a Tic Tac Toe match against me."""
-        if position is None:
-            self.board = [[1, 2, 3], [4, 5, 6], [7, 8, 9]]
-        elif self.board is None:
-            self.client.send_message("Game hasn't been started.")
+    def on_connect(self):
+        self.job = self.client.scheduler.call_every(60, self.expire)
+
+    def on_disconnect(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def on_unload(self):
+        self.on_disconnect()
+
+    def export_state(self):
+        games = []
+        for game in {id(game): game for game in self.games.values()}.values():
+            games.append({
+                "players": [None if player is None else player.name for player in game.players],
+                "bits": game.bits,
+                "turn": game.turn,
+                "hard": game.hard,
+            })
+        challenges = {name: challenger.name for name, (challenger, _) in self.challenges.items()}
+        return {"games": games, "challenges": challenges}
+
+    def import_state(self, state):
+        self.games = OrderedDict()
+        for data in state["games"]:
+            players = tuple(
+                None if name is None else self.client.users.get(name.lower(), User(name, None, False))
+                for name in data["players"]
+            )
+            game = Game(players, data["hard"])
+            game.bits = list(data["bits"])
+            game.turn = data["turn"]
+            self.start(game)
+        self.challenges = {
+            name: (self.client.users.get(challenger.lower(), User(challenger, None, False)), monotonic())
+            for name, challenger in state["challenges"].items()
+        }
+
+    def expire(self):
+        deadline = monotonic() - self.idle_timeout
+        for name, game in list(self.games.items()):
+            if game.last_active < deadline:
+                self.games.pop(name, None)
+        for name, (challenger, timestamp) in list(self.challenges.items()):
+            if timestamp < deadline:
+                self.challenges.pop(name, None)
+
+    def start(self, game):
+        for player in game.players:
+            if player is not None:
+                self.end(self.games.get(player.name.lower()))
+                self.games[player.name.lower()] = game
+        while len(self.games) > self.max_games:
+            self.end(next(iter(self.games.values())))
+
+    def end(self, game):
+        if game is None:
             return
-        else:
-            row, col = divmod(position - 1, len(self.board))
-            if row not in range(3) or col not in range(3):
-                self.client.send_message("Invalid position, please choose another.")
-                return
+        for player in game.players:
+            if player is not None and self.games.get(player.name.lower()) is game:
+                del self.games[player.name.lower()]
 
-            if self.board[row][col] in ["X", "O"]:
-                self.client.send_message("Position is already occupied, please choose another.")
-                return
+    @Command(sender=Argument(implicit=True), move=Argument(required=False))
+    def xo(self, sender, move=None):
+        """Play Tic Tac Toe: !xo [hard] against me, !xo <user> against someone else, then !xo <position>."""
+        if move is None or move.lower() == "hard":
+            game = Game((sender, None), hard=move is not None)
+            self.start(game)
+            self.client.send_message(f"{game}\nIt's {sender}'s turn: please choose where to place X.")
+            return
 
-            self.board[row][col] = "X"
-            if self.check_winner():
-                self.client.send_message(f"{self.board_str()}\n{sender} won the match!")
+        if move.lower() == "quit":
+            game = self.games.get(sender.name.lower())
+            if game is None:
+                self.client.send_message(f"{sender}, you are not playing.")
                 return
+            self.end(game)
+            self.client.send_message(f"{sender} forfeited the match.")
+            return
 
-            options = [(i, j) for i, row in enumerate(self.board) for j, cell in enumerate(row) if cell not in ["X", "O"]]
-            if not options:
-                self.client.send_message(f"{self.board_str()}\nTie!")
-                return
+        if not move.isdigit():
+            self.challenge(sender, self.client.users.get(move.lower(), User(move, None, False)))
+            return
 
-            row, col = choice(options)
-            self.board[row][col] = "O"
-            if self.check_winner():
-                self.client.send_message(f"{self.board_str()}\nI won the match!")
-                return
+        game = self.games.get(sender.name.lower())
+        if game is None:
+            self.client.send_message("Game hasn't been started.")
+            return
+        self.games.move_to_end(sender.name.lower())
+        player = game.players[game.turn]
+        if player is None or player != sender:
+            self.client.send_message(f"{sender}, it's not your turn.")
+            return
 
-        self.client.send_message(f"{self.board_str()}\nIt's {sender}'s turn: please choose where to place X.")
+        cell = int(move) - 1
+        if cell not in range(9):
+            self.client.send_message("Invalid position, please choose another.")
+            return
+        if not game.empty & (1 << cell):
+            self.client.send_message("Position is already occupied, please choose another.")
+            return
 
-    def board_str(self):
-        return "\n\u2550\u256c\u2550\u256c\u2550\n".join("\u2551".join(map(str, row)) for row in self.board)
+        if game.play(cell):
+            self.end(game)
+            self.client.send_message(f"{game}\n{sender} won the match!")
+            return
+        if not game.empty:
+            self.end(game)
+            self.client.send_message(f"{game}\nTie!")
+            return
+
+        if game.players[game.turn] is None:
+            if game.play(game.bot_move()):
+                self.end(game)
+                self.client.send_message(f"{game}\nI won the match!")
+                return
+            if not game.empty:
+                self.end(game)
+                self.client.send_message(f"{game}\nTie!")
+                return
+
+        symbol = "XO"[game.turn]
+        self.client.send_message(f"{game}\nIt's {game.players[game.turn]}'s turn: please choose where to place {symbol}.")
 
-    def check_winner(self):
-        return any(len(set(seq)) == 1 for seq in (
-            *self.board,
-            *zip(*self.board),
-            (self.board[i][i] for i in range(len(self.board))),
-            (self.board[i][2 - i] for i in range(len(self.board))),
-        ))
+    def challenge(self, sender, target):
+        if target == sender:
+            self.client.send_message(f"{sender}, you can't play against yourself.")
+            return
+        if target == self.client.user:
+            self.client.send_message(f"{sender}, use !xo to play against me.")
+            return
+        if not target.connected:
+            self.client.send_message(f"{sender}, {target} is not here.")
+            return
+        challenger = self.challenges.get(sender.name.lower())
+        if challenger is not None and challenger[0] == target:
+            del self.challenges[sender.name.lower()]
+            game = Game((target, sender))
+            self.start(game)
+            self.client.send_message(f"{game}\nIt's {target}'s turn: please choose where to place X.")
+            return
+        self.challenges[target.name.lower()] = (sender, monotonic())
+        self.client.send_message(f"{target}, {sender} challenged you to Tic Tac Toe. Reply with !xo {sender} to accept.")
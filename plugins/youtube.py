@@ -1,12 +1,12 @@
 import re
-import requests
 import isodate
 from datetime import datetime
 
-from chatbot.plugins import Plugin
+from chatbot.plugins import Plugin, Priority, Filter
 
 @Plugin()
 class YouTubePlugin:
+    PRIORITY = Priority.PREVIEW
     URL_REGEX = re.compile(r"(?:https?:\/\/)?(?:www\.)?(?:youtu\.be\/|youtube\.com\/(?:embed\/|v\/|watch\?(?:.+&)?v=))(?P<id>[0-9A-Za-z_-]{11})")
 
     def __init__(self, key):
@@ -18,10 +18,11 @@ class YouTubePlugin:
         self.client = client
         self.logger = logger
 
+    @Filter(ignore_self=True, contains=("youtube.com", "youtu.be"))
     def on_message(self, data):
         message = data["attrs"]["text"]
         for match in self.URL_REGEX.finditer(message):
-            item = requests.get("https://www.googleapis.com/youtube/v3/videos", params={
+            item = self.client.http.get("https://www.googleapis.com/youtube/v3/videos", params={
                 "id": match["id"],
                 "key": self.key,
                 "part": "snippet, statistics, contentDetails",
@@ -0,0 +1,85 @@
+import time
+import unittest
+from unittest import mock
+
+from chatbot import ChatBot
+from chatbot.events import JoinEvent, MessageEvent
+from chatbot.plugins import Plugin, Command
+from plugins.flood import FloodPlugin
+
+@Plugin()
+class ProbePlugin:
+    def __init__(self, actions):
+        self.actions = actions
+
+    def on_load(self, client, logger):
+        pass
+
+    @Command()
+    def probe(self):
+        self.actions.append("probe")
+
+class FloodTest(unittest.TestCase):
+    def setUp(self):
+        self.bot = ChatBot("Bot", "password", "http://127.0.0.1:1/", reconnect=False)
+        self.actions = []
+        self.kicked = []
+        self.bot.send = self.send
+        self.flood = FloodPlugin()
+        self.bot.add_plugins(self.flood, ProbePlugin(self.actions))
+        self.join("Bot")
+
+    def send(self, attrs):
+        self.actions.append(attrs["command"])
+        if attrs["command"] == "kick":
+            self.kicked.append(attrs["userToKick"])
+
+    def join(self, name):
+        data = {"attrs": {"name": name, "isModerator": False, "canPromoteModerator": False}}
+        self.bot.on_join(data, JoinEvent(self.bot, data))
+
+    def event(self, name, text):
+        data = {"id": 1, "attrs": {"name": name, "text": text, "timeStamp": int(time.time() * 1000)}}
+        return MessageEvent(self.bot, data)
+
+    def message(self, name, text):
+        event = self.event(name, text)
+        self.bot.on_message(event.data, event)
+
+    def drain(self):
+        self.bot.dispatcher.start()
+        deadline = time.monotonic() + 5
+        while self.bot.dispatcher.heap and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+
+    def test_flood_counted_before_queued_command(self):
+        # Everything queues up before the dispatcher runs, like under a backlog.
+        self.join("Spammer")
+        for i in range(self.flood.message_limit[0]):
+            self.message("Spammer", f"spam {i}")
+        self.message("Spammer", "!probe")
+        self.drain()
+        self.assertEqual(self.actions, ["kick", "probe"])
+
+    def test_busy_room_is_not_a_flood(self):
+        chatters = [f"Chatter {i}" for i in range(30)]
+        for name in chatters:
+            self.join(name)
+        self.join("Spammer")
+        clock = [1000.0]
+        with mock.patch("plugins.flood.monotonic", lambda: clock[0]):
+            # 30 chatters sending two messages every four seconds, and one at two a second.
+            for tick in range(60):
+                clock[0] += 1
+                for i, name in enumerate(chatters):
+                    if (tick + i) % 4 == 0:
+                        self.flood.on_message(None, self.event(name, f"message {tick}"))
+                        self.flood.on_message(None, self.event(name, f"and more {tick}"))
+                for i in range(2):
+                    self.flood.on_message(None, self.event("Spammer", f"spam {tick} {i}"))
+        self.assertEqual(self.kicked, ["Spammer"] * self.actions.count("kick"))
+        self.assertIn("kick", self.actions)
+
+if __name__ == "__main__":
+    unittest.main()
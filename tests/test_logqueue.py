@@ -0,0 +1,57 @@
+import io
+import os
+import json
+import logging
+import tempfile
+import unittest
+
+from chatbot.logqueue import LogPipeline
+
+class LogPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.handlers = logging.root.handlers[:]
+        self.level = logging.root.level
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "log.json")
+        self.stream = io.StringIO()
+        self.pipeline = LogPipeline(json_path=self.path, stream=self.stream)
+        self.pipeline.start()
+
+    def tearDown(self):
+        logging.root.handlers[:] = self.handlers
+        logging.root.setLevel(self.level)
+        self.directory.cleanup()
+
+    def records(self):
+        self.pipeline.stop()
+        with open(self.path, encoding="utf-8") as log_file:
+            return [json.loads(line) for line in log_file]
+
+    def test_exception_field(self):
+        try:
+            raise ValueError("broken")
+        except ValueError:
+            logging.getLogger("test").exception("Failed with %s.", "details")
+        record, = self.records()
+        self.assertEqual(record["message"], "Failed with details.")
+        self.assertIn("ValueError: broken", record["exception"])
+        self.assertNotIn("Traceback", record["message"])
+        self.assertIn("ValueError: broken", self.stream.getvalue())
+
+    def test_no_exception_field(self):
+        logging.getLogger("test").warning("Nothing wrong.")
+        record, = self.records()
+        self.assertEqual(record["message"], "Nothing wrong.")
+        self.assertNotIn("exception", record)
+
+    def test_rate_limit_formatted_messages(self):
+        logger = logging.getLogger("test")
+        for i in range(20):
+            logger.warning(f"Dropped event {i}.")
+        logger.warning("Something else.")
+        messages = [record["message"] for record in self.records()]
+        self.assertEqual(messages, [f"Dropped event {i}." for i in range(5)] + ["Something else."])
+        self.assertEqual(self.pipeline.limiter.suppressed, 15)
+
+if __name__ == "__main__":
+    unittest.main()